@@ -0,0 +1,228 @@
+"""Prebuilt accession -> taxid/title lookup file built from NCBI bulk dumps.
+
+Inputs are accession2taxid files (accession, accession.version, taxid, gi) and optional
+title tables (accession.version<TAB>title, e.g. from `blastdbcmd -outfmt "%a\t%t"`).
+Rows are external-merge-sorted into fixed-width records followed by a title blob, so
+the file can be memory-mapped and searched with a binary search. Usage:
+
+    python accession_index.py build OUT --taxid nucl_gb.accession2taxid.gz [--titles titles.tsv ...]
+    python accession_index.py lookup OUT ACCESSION...
+    python accession_index.py bench [--rows N]
+"""
+import argparse
+import bisect
+import gzip
+import heapq
+import mmap
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+ACCESSION_INDEX_MAGIC = b"BACCIDX1"
+ACCESSION_KEY_BYTES = 24
+# magic, record count, title blob offset
+_HEADER = struct.Struct("<8sQQ")
+# accession.version (NUL padded), taxid, title offset, title length
+_RECORD = struct.Struct(f"<{ACCESSION_KEY_BYTES}sIQI")
+SORT_CHUNK_ROWS = 2_000_000  # Rows held in memory per sorted run during a build
+
+LocalRecord = Tuple[int, str]  # (taxid or 0, title or "")
+
+
+def _open_text(path: str):
+    with open(path, "rb") as fh: is_gzip = fh.read(2) == b"\x1f\x8b"
+    return gzip.open(path, "rt", encoding="utf-8", errors="replace") if is_gzip else open(path, "r", encoding="utf-8", errors="replace")
+
+
+def _taxid_rows(path: str) -> Iterator[Tuple[str, str, str]]:
+    with _open_text(path) as fh:
+        for line in fh:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 3 or not fields[2].isdigit(): continue  # Header or malformed row
+            yield fields[1], "T", fields[2]
+
+
+def _title_rows(path: str) -> Iterator[Tuple[str, str, str]]:
+    with _open_text(path) as fh:
+        for line in fh:
+            acc, _, title = line.rstrip("\n").partition("\t")
+            if acc and title: yield acc, "D", title
+
+
+def _sorted_runs(rows: Iterable[str], tmp_dir: str) -> List[str]:
+    """Splits rows into sorted temporary run files of at most SORT_CHUNK_ROWS rows."""
+    runs, chunk = [], []
+    def flush():
+        chunk.sort()
+        fd, path = tempfile.mkstemp(dir=tmp_dir, suffix=".run")
+        with os.fdopen(fd, "w", encoding="utf-8") as out: out.writelines(chunk)
+        runs.append(path); chunk.clear()
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= SORT_CHUNK_ROWS: flush()
+    if chunk: flush()
+    return runs
+
+
+def build_accession_index(out_path: str, taxid_paths: List[str], title_paths: Optional[List[str]] = None) -> int:
+    """Builds the lookup file and returns the number of accessions written.
+    Accessions longer than ACCESSION_KEY_BYTES are skipped. If an accession has several
+    taxid or title rows, the first one in input order (files in the order given) is kept."""
+    def all_rows():
+        sources = [_taxid_rows(p) for p in taxid_paths] + [_title_rows(p) for p in title_paths or []]
+        seq = 0
+        for rows in sources:
+            for acc, kind, value in rows: # The zero-padded input position sorts duplicates back into input order
+                yield f"{acc}\t{kind}\t{seq:012d}\t{value}\n"; seq += 1
+    tmp_dir = tempfile.mkdtemp(prefix="accidx-", dir=os.path.dirname(os.path.abspath(out_path)))
+    try:
+        runs = _sorted_runs(all_rows(), tmp_dir)
+        run_files = [open(p, "r", encoding="utf-8") for p in runs]
+        table_path, blob_path = os.path.join(tmp_dir, "table"), os.path.join(tmp_dir, "blob")
+        count, blob_len = 0, 0
+        with open(table_path, "wb") as table, open(blob_path, "wb") as blob:
+            current, taxid, title = None, 0, b""
+            def emit():
+                nonlocal count, blob_len
+                key = current.encode("ascii", "replace")
+                if len(key) > ACCESSION_KEY_BYTES: return
+                table.write(_RECORD.pack(key, taxid, blob_len, len(title)))
+                blob.write(title); blob_len += len(title); count += 1
+            for row in heapq.merge(*run_files):
+                acc, kind, _, value = row.rstrip("\n").split("\t", 3)
+                if acc != current:
+                    if current is not None: emit()
+                    current, taxid, title = acc, 0, b""
+                if kind == "T":
+                    if not taxid: taxid = int(value)
+                elif not title: title = value.encode("utf-8")
+            if current is not None: emit()
+        for fh in run_files: fh.close()
+        tmp_out = out_path + ".tmp"
+        with open(tmp_out, "wb") as out:
+            out.write(_HEADER.pack(ACCESSION_INDEX_MAGIC, count, _HEADER.size + count * _RECORD.size))
+            for part in (table_path, blob_path):
+                with open(part, "rb") as fh: shutil.copyfileobj(fh, out, 1 << 20)
+        os.replace(tmp_out, out_path)
+        return count
+    finally: shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class _KeyView:
+    """Sequence view over the record keys so bisect can search the mapped table directly."""
+    def __init__(self, index: "AccessionIndex"): self._index = index
+    def __len__(self): return self._index.count
+    def __getitem__(self, i: int) -> bytes: return self._index._key(i)
+
+
+class AccessionIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self._blob_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != ACCESSION_INDEX_MAGIC: self.close(); raise ValueError(f"{path} is not an accession index.")
+        self._keys = _KeyView(self)
+
+    @classmethod
+    def open_optional(cls, path: Optional[str]) -> Optional["AccessionIndex"]:
+        """Opens the index if the file exists; returns None otherwise."""
+        if not path or not os.path.exists(path): return None
+        return cls(path)
+
+    def _key(self, i: int) -> bytes:
+        start = _HEADER.size + i * _RECORD.size
+        return self._mm[start:start + ACCESSION_KEY_BYTES].rstrip(b"\0")
+
+    def _record(self, i: int) -> LocalRecord:
+        _, taxid, title_off, title_len = _RECORD.unpack_from(self._mm, _HEADER.size + i * _RECORD.size)
+        start = self._blob_offset + title_off
+        return taxid, self._mm[start:start + title_len].decode("utf-8", "replace")
+
+    def _find(self, key: bytes, lo: int = 0) -> Tuple[Optional[int], int]:
+        """Returns (record position or None, insertion point). Unversioned keys match the
+        highest numeric version present, as EFetch returns the latest version. Versions sort
+        as bytes (".10" before ".9"), so the whole run of "key." entries is scanned."""
+        pos = bisect.bisect_left(self._keys, key, lo)
+        if pos < self.count and self._key(pos) == key: return pos, pos
+        if b"." not in key:
+            prefix, best, best_version = key + b".", None, -1
+            vpos = bisect.bisect_left(self._keys, prefix, pos)
+            while vpos < self.count and self._key(vpos).startswith(prefix):
+                version = self._key(vpos)[len(prefix):]
+                if best is None or (version.isdigit() and int(version) > best_version):
+                    best, best_version = vpos, int(version) if version.isdigit() else -1
+                vpos += 1
+            if best is not None: return best, pos
+        return None, pos
+
+    def lookup(self, accession: str) -> Optional[LocalRecord]:
+        if not accession or accession == "N/A": return None
+        pos, _ = self._find(accession.encode("ascii", "replace"))
+        return self._record(pos) if pos is not None else None
+
+    def lookup_many(self, accessions: Iterable[str]) -> Dict[str, LocalRecord]:
+        """Batched lookup: keys are searched in sorted order, each search starting where
+        the previous one ended. Accessions that are not in the index are omitted."""
+        found, lo = {}, 0
+        for acc in sorted({a for a in accessions if a and a != "N/A"}):
+            pos, lo = self._find(acc.encode("ascii", "replace"), lo)
+            if pos is not None: found[acc] = self._record(pos)
+        return found
+
+    def close(self):
+        if getattr(self, "_mm", None) is not None: self._mm.close(); self._mm = None
+        self._file.close()
+
+
+def run_benchmark(rows: int, lookups: int = 200_000):
+    """Builds an index from synthetic accession2taxid/title fixtures and reports build time,
+    file size and lookup throughput."""
+    rng = random.Random(0)
+    tmp_dir = tempfile.mkdtemp(prefix="accidx-bench-")
+    try:
+        taxid_path, title_path, out_path = (os.path.join(tmp_dir, n) for n in ("fixture.accession2taxid", "fixture.titles", "fixture.accidx"))
+        accessions = [f"{rng.choice(('XM_', 'NM_', 'AB', 'KX', 'MN'))}{rng.randrange(10**8):08d}.{rng.randrange(1, 4)}" for _ in range(rows)]
+        with open(taxid_path, "w") as fh:
+            fh.write("accession\taccession.version\ttaxid\tgi\n")
+            for acc in accessions: fh.write(f"{acc.split('.')[0]}\t{acc}\t{rng.randrange(1, 3_000_000)}\t0\n")
+        with open(title_path, "w") as fh:
+            for acc in accessions[::2]: fh.write(f"{acc}\tPREDICTED: synthetic protein {acc} mRNA, complete cds\n")
+        started = time.perf_counter(); count = build_accession_index(out_path, [taxid_path], [title_path]); build_s = time.perf_counter() - started
+        print(f"rows={rows} unique={count} build={build_s:.1f}s size={os.path.getsize(out_path) / 1e6:.1f}MB")
+        index = AccessionIndex(out_path)
+        sample = [rng.choice(accessions) for _ in range(lookups)]
+        started = time.perf_counter()
+        for acc in sample: index.lookup(acc)
+        single_s = time.perf_counter() - started
+        started = time.perf_counter()
+        for i in range(0, lookups, 500): index.lookup_many(sample[i:i + 500])
+        batch_s = time.perf_counter() - started
+        print(f"lookup: {lookups / single_s:,.0f}/s single, {lookups / batch_s:,.0f}/s batched (500 per batch)")
+        index.close()
+    finally: shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build, query or benchmark the accession -> taxid/title index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_p = sub.add_parser("build"); build_p.add_argument("out")
+    build_p.add_argument("--taxid", action="append", default=[], help="accession2taxid file (gzip ok); repeatable")
+    build_p.add_argument("--titles", action="append", default=[], help="accession.version<TAB>title file (gzip ok); repeatable")
+    lookup_p = sub.add_parser("lookup"); lookup_p.add_argument("index"); lookup_p.add_argument("accessions", nargs="+")
+    bench_p = sub.add_parser("bench"); bench_p.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+    if args.command == "build":
+        if not args.taxid and not args.titles: parser.error("build needs at least one --taxid or --titles file")
+        started = time.perf_counter()
+        n = build_accession_index(args.out, args.taxid, args.titles)
+        print(f"Indexed {n} accessions into {args.out} ({os.path.getsize(args.out)} bytes) in {time.perf_counter() - started:.1f}s.")
+    elif args.command == "lookup":
+        index = AccessionIndex(args.index)
+        for acc, (taxid, title) in index.lookup_many(args.accessions).items(): print(f"{acc}\t{taxid}\t{title}")
+        index.close()
+    else: run_benchmark(args.rows)
@@ -1,10 +1,15 @@
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
+from tkinter import ttk, scrolledtext, messagebox, filedialog
 import requests
-import time
-import xml.etree.ElementTree as ET
 import threading
+from concurrent.futures import ThreadPoolExecutor
+import os
+import argparse
 from typing import Optional, Dict, List, Tuple # Added this import
+from blast_core import BlastHit, format_evalue_static, shutdown_parse_pool
+from fasta_index import SequenceIndex
+from taxonomy import DIVERSITY_RANKS
+from pipeline import BlastPipeline, SearchSession
 
 # --- Suppress NotOpenSSLWarning ---
 import warnings
@@ -15,71 +20,19 @@ except ImportError:
     pass
 
 # --- Configuration Constants ---
-NCBI_BLAST_API_URL = "https://blast.ncbi.nlm.nih.gov/Blast.cgi"
-NCBI_EUTILS_EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-DEFAULT_BLAST_FORMAT_TYPE = "XML"
+# NCBI endpoints, polling limits and index paths live in pipeline.py.
 DEFAULT_BLAST_PROGRAM = "blastn"
 DEFAULT_BLASTN_DATABASE = "nt"
 DEFAULT_BLASTX_DATABASE = "nr"
 DEFAULT_EST_DATABASE = "est"
-BLAST_POLL_INTERVAL_SECONDS = 10
-BLAST_MAX_UNKNOWN_RETRIES = 5
-NCBI_API_REQUEST_DELAY_SECONDS = 1
-MAX_TOTAL_POLLS = 180 # Approx 30 minutes (180 polls * 10s/poll)
-
-# --- Data Model (BlastHit) ---
-class BlastHit:
-    def __init__(self, accession: Optional[str] = None, hit_def_raw: Optional[str] = None,
-                 definition: Optional[str] = None, organism: Optional[str] = None,
-                 query_start: Optional[str] = None, query_start_base: Optional[str] = None,
-                 query_end: Optional[str] = None, query_end_base: Optional[str] = None,
-                 e_value: Optional[str] = None, hsp_details: Optional[Dict[str, any]] = None):
-        self.accession = accession
-        self.hit_def_raw = hit_def_raw
-        self.definition = definition
-        self.organism = organism
-        self.query_start = query_start
-        self.query_start_base = query_start_base
-        self.query_end = query_end
-        self.query_end_base = query_end_base
-        self.e_value = e_value
-        self.hsp_details = hsp_details if hsp_details is not None else {}
-    def __repr__(self):
-        return (f"BlastHit(accession='{self.accession}', organism='{self.organism}', "
-                f"e_value='{self.e_value}', definition='{self.definition[:30] if self.definition else 'N/A'}...')")
-
-# --- Helper Functions ---
-def format_evalue_static(e_value_str: str) -> str:
-    if not e_value_str: return "N/A"
-    try:
-        e_value_float = float(e_value_str)
-        if e_value_float == 0.0: return "0"
-        sci_notation = f"{e_value_float:e}"
-        parts = sci_notation.split('e')
-        significand_str, exponent_val = parts[0], int(parts[1])
-        rounded_digit = round(float(significand_str))
-        if abs(rounded_digit) >= 10:
-            exponent_val += 1
-            rounded_digit /= 10
-        return f"{int(rounded_digit)}e{exponent_val}"
-    except: return e_value_str
-
-def parse_ncbi_hit_id_static(hit_id_text: str) -> str:
-    if not hit_id_text: return "N/A"
-    parts = hit_id_text.split('|')
-    known_prefixes = ["ref", "pdb", "sp", "gb", "emb", "dbj", "prf", "tpg"]
-    if len(parts) >= 4 and parts[2] in known_prefixes: return parts[3]
-    if len(parts) >= 2 and parts[0] in known_prefixes: return parts[1]
-    if len(parts) == 1 and not any(p in hit_id_text for p in [f"{pref}|" for pref in known_prefixes] + ["gi|"]): return hit_id_text
-    if parts:
-        potential_acc = parts[-1].strip()
-        if potential_acc: return potential_acc
-        if len(parts) > 1 and parts[-2].strip(): return parts[-2].strip()
-    return hit_id_text
+REMOTE_LONG_POLL_SECONDS = 25 # Thin-client long-poll wait per request to the job server
+REMOTE_REQUEST_TIMEOUT_SECONDS = 15
+BATCH_CONCURRENT_RECORDS = 3 # Batch records in flight at once, so their BLAST waits and XML parses overlap
+RESELECT_DEBOUNCE_MS = 300 # Wait for filter edits to settle before re-applying hit selection
 
 
 class BlastApp:
-    def __init__(self, root):
+    def __init__(self, root, server_url: Optional[str] = None):
         self.root = root
         self.root.title("NCBI BLAST GUI Client")
         self.root.geometry("900x700")
@@ -87,18 +40,31 @@ class BlastApp:
         self.sequence_var = tk.StringVar()
         self.program_var = tk.StringVar(value="blastn")
         self.database_var = tk.StringVar(value="nt")
+        self.fan_out_vars: Dict[str, tk.BooleanVar] = {} # Ticked databases of the current program are searched together
         self.exclude_landoltia_var = tk.BooleanVar()
         self.def_format_var = tk.StringVar(value="full")
         self.max_detail_hits_var = tk.IntVar(value=20)
         self.target_results_var = tk.IntVar(value=3)
+        self.diversity_level_var = tk.StringVar(value="organism")
+        self.exclude_clades_var = tk.StringVar()
 
         self.PROGRAM_OPTIONS = ["blastn", "blastx"]
         self.DATABASE_OPTIONS_BLASTN = ["nt", "est", "refseq_rna"]
         self.DATABASE_OPTIONS_BLASTX = ["nr", "refseq_protein", "swissprot"]
         self.DEF_FORMAT_OPTIONS = ["full", "short"]
+        self.DIVERSITY_OPTIONS = ["organism"] + DIVERSITY_RANKS
         self.DEFAULT_DNA_SEQUENCE = "AGGAGAAGAAGAAAGAGGAGGAGAAACAGTCGACGTCTTCGTTTCTTACTCTGCATTCTGCGGGTGAATTCATGGACCGTGTGAAGAGGCTGAGCACGCAGAAGGCGGTGGTGATATTCAGCTCGAGCTCGTGCTGCATGTGCCACGCAGTCAAGGCCTTCTTCCAGGATCTCGGGGTGAACTACGCCGCCTACGAGCTCGACGAGGAACCCCACGGAAGGGAGATGGAGAAGGCTCTTCTCCGGCTAGTCGGCCGGAACCCGCCATTTCCGGCAGTCTACATCGGCGGCAAGCTTGTCGGCCCGACAGACCGCGTCATGTCCCTCCATCTCAGTGGCAAGCTTATGCCCATGCTGCGGGAAGCAGGCGCTAAATGGCTGTAGTCAGGCTCTCTGCGAAACCCTAACGCTAGCGGCTCTCGGTTAACCTGTGTTGACAAGTGGGCCGCGCTCTGTAGTCGTGCTCTTAAATGGGCTTGGGCCCGTGCTCCGTTTCATCTCCGTTTCTCTCCCAAAAGCAAATCCGTCCGTTAGAGTCGCACGTGGGGGAATCGGCAGACACGTGGATCTTCTTCTGTCAGAAATCGGCCTGACATTCCTCGTGGGCTTTTTCTTAATGGACTACTTACTTCGGCCCGCCTCTCAGATCGGCGAGCCCTCCTATGTACTCGGGCAGTTTAATTAATTTACAATTAATTAACCAAAAAAAAAAAAAAAAAAAAAAAAAA"
         self.sequence_var.set(self.DEFAULT_DNA_SEQUENCE)
+        self.seq_index: Optional[SequenceIndex] = None # Set while a FASTA/FASTQ file is loaded
+        self.server_url = server_url.rstrip("/") if server_url else None # Thin-client mode: jobs run on server.py
+        self.sessions: List[object] = [] # Last run's SearchSessions (or server job ids), re-selected when filters change
+        self._reselect_after_id, self._reselect_pending = None, False
         self.create_widgets()
+        for var in (self.exclude_landoltia_var, self.def_format_var, self.max_detail_hits_var, self.target_results_var,
+                    self.diversity_level_var, self.exclude_clades_var):
+            var.trace_add("write", self._schedule_reselect)
+        if self.server_url: self.pipeline = None; self.log_status(f"Thin-client mode: jobs run on {self.server_url}.")
+        else: self.pipeline: Optional[BlastPipeline] = BlastPipeline.from_environment(log=self.log_status)
 
     def create_widgets(self):
         main_pane = ttk.PanedWindow(self.root, orient=tk.VERTICAL)
@@ -110,7 +76,7 @@ class BlastApp:
         seq_label = ttk.Label(controls_frame, text="Sequence:")
         seq_label.grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
         self.sequence_text = scrolledtext.ScrolledText(controls_frame, wrap=tk.WORD, height=10, width=70)
-        self.sequence_text.grid(row=0, column=1, columnspan=3, sticky="ew", padx=5, pady=5)
+        self.sequence_text.grid(row=0, column=1, columnspan=4, sticky="ew", padx=5, pady=5)
         self.sequence_text.insert(tk.END, self.sequence_var.get())
         self.sequence_text.focus_set() # Set initial focus
 
@@ -124,6 +90,8 @@ class BlastApp:
         db_label.grid(row=1, column=2, sticky=tk.W, padx=5, pady=5)
         self.db_combo = ttk.Combobox(controls_frame, textvariable=self.database_var, state="readonly", width=15)
         self.db_combo.grid(row=1, column=3, sticky=tk.W, padx=5, pady=5)
+        self.fan_out_frame = ttk.Frame(controls_frame) # One checkbutton per database, rebuilt when the program changes
+        self.fan_out_frame.grid(row=1, column=4, sticky=tk.W, padx=5, pady=5)
         self.update_database_options()
 
         self.exclude_landoltia_check = ttk.Checkbutton(controls_frame, text="Exclude Landoltia punctata", variable=self.exclude_landoltia_var)
@@ -144,8 +112,22 @@ class BlastApp:
         self.target_results_spinbox = ttk.Spinbox(controls_frame, from_=1, to=50, textvariable=self.target_results_var, width=7)
         self.target_results_spinbox.grid(row=3, column=3, sticky=tk.W, padx=5, pady=5)
 
+        diversity_label = ttk.Label(controls_frame, text="One Hit Per:")
+        diversity_label.grid(row=4, column=0, sticky=tk.W, padx=5, pady=5)
+        self.diversity_combo = ttk.Combobox(controls_frame, textvariable=self.diversity_level_var, values=self.DIVERSITY_OPTIONS, state="readonly", width=10)
+        self.diversity_combo.grid(row=4, column=1, sticky=tk.W, padx=5, pady=5)
+
+        exclude_clades_label = ttk.Label(controls_frame, text="Exclude Clades:")
+        exclude_clades_label.grid(row=4, column=2, sticky=tk.W, padx=5, pady=5)
+        self.exclude_clades_entry = ttk.Entry(controls_frame, textvariable=self.exclude_clades_var, width=25) # Comma-separated names or taxids
+        self.exclude_clades_entry.grid(row=4, column=3, sticky="ew", padx=5, pady=5)
+
+        self.load_file_button = ttk.Button(controls_frame, text="Load FASTA/FASTQ...", command=self.load_sequence_file)
+        self.load_file_button.grid(row=5, column=0, sticky=tk.W, padx=5, pady=10)
         self.run_button = ttk.Button(controls_frame, text="Run BLAST", command=self.start_blast_thread)
-        self.run_button.grid(row=4, column=1, columnspan=2, pady=10)
+        self.run_button.grid(row=5, column=1, columnspan=2, pady=10)
+        self.clear_file_button = ttk.Button(controls_frame, text="Clear File", command=self.clear_sequence_file, state=tk.DISABLED)
+        self.clear_file_button.grid(row=5, column=3, sticky=tk.E, padx=5, pady=10)
 
         controls_frame.columnconfigure(1, weight=1)
         controls_frame.columnconfigure(3, weight=1)
@@ -161,16 +143,18 @@ class BlastApp:
         results_frame = ttk.LabelFrame(output_pane, text="Results", padding=10)
         output_pane.add(results_frame, weight=2)
 
-        columns = ("accession", "definition", "organism", "query_start", "query_end", "e_value")
-        self.results_tree = ttk.Treeview(results_frame, columns=columns, show="headings")
+        columns = ("query", "accession", "definition", "organism", "query_start", "query_end", "e_value", "databases")
+        self.results_tree = ttk.Treeview(results_frame, columns=columns, show="headings", displaycolumns=columns[1:-1])
 
         for col in columns: self.results_tree.heading(col, text=col.replace("_", " ").title())
+        self.results_tree.column("query", width=100, anchor=tk.W)
         self.results_tree.column("accession", width=100, anchor=tk.W)
         self.results_tree.column("definition", width=250, anchor=tk.W)
         self.results_tree.column("organism", width=150, anchor=tk.W)
         self.results_tree.column("query_start", width=80, anchor=tk.CENTER)
         self.results_tree.column("query_end", width=80, anchor=tk.CENTER)
         self.results_tree.column("e_value", width=80, anchor=tk.CENTER)
+        self.results_tree.column("databases", width=120, anchor=tk.W)
 
         vsb = ttk.Scrollbar(results_frame, orient="vertical", command=self.results_tree.yview)
         hsb = ttk.Scrollbar(results_frame, orient="horizontal", command=self.results_tree.xview)
@@ -189,26 +173,110 @@ class BlastApp:
             if self.database_var.get() not in self.DATABASE_OPTIONS_BLASTX:
                 self.database_var.set(self.DATABASE_OPTIONS_BLASTX[0])
         else: self.db_combo['values'] = []
+        self._build_fan_out_checks(list(self.db_combo['values']))
+
+    def _build_fan_out_checks(self, databases: List[str]):
+        for child in self.fan_out_frame.winfo_children(): child.destroy()
+        ttk.Label(self.fan_out_frame, text="Search together:").pack(side=tk.LEFT)
+        self.fan_out_vars = {db: tk.BooleanVar() for db in databases}
+        for db, var in self.fan_out_vars.items():
+            ttk.Checkbutton(self.fan_out_frame, text=db, variable=var, command=self.toggle_fan_out).pack(side=tk.LEFT)
+        self.toggle_fan_out()
+
+    def toggle_fan_out(self):
+        # The single-database combo is ignored while any database is ticked
+        self.db_combo.config(state=tk.DISABLED if any(var.get() for var in self.fan_out_vars.values()) else "readonly")
+
+    def _selected_databases(self):
+        """The combo's database, or the ticked databases (in menu order) when any are ticked."""
+        ticked = [db for db, var in self.fan_out_vars.items() if var.get()]
+        if not ticked: return self.database_var.get()
+        return ticked if len(ticked) > 1 else ticked[0]
+
+    def _set_result_columns(self, batch: bool, multi_db: bool):
+        columns = list(self.results_tree["columns"])
+        if not batch: columns.remove("query")
+        if not multi_db: columns.remove("databases")
+        self.results_tree.config(displaycolumns=columns)
+
+    def load_sequence_file(self):
+        path = filedialog.askopenfilename(title="Load FASTA/FASTQ", filetypes=[
+            ("Sequence files", "*.fa *.fasta *.fna *.ffn *.fq *.fastq *.gz"), ("All files", "*")])
+        if not path: return
+        self._set_busy(True)
+        self.log_status(f"Indexing {path}...")
+        threading.Thread(target=self._load_sequence_file, args=(path,), daemon=True).start()
+
+    def _load_sequence_file(self, path: str):
+        seq_index = None
+        try:
+            seq_index = SequenceIndex(path)
+            invalid = seq_index.validate()
+            preview = seq_index.preview()
+        except Exception as e: # Any failure must still re-enable the controls
+            if seq_index is not None: seq_index.close()
+            self.log_status(f"File load Err: {e}")
+            self.root.after_idle(lambda msg=str(e): messagebox.showerror("File Error", msg))
+            self.root.after_idle(self._finish_run)
+            return
+        self.log_status(f"Indexed {len(seq_index)} {seq_index.format.upper()} record(s) from {path}.")
+        for i, bad in invalid[:10]: self.log_status(f"Invalid record {seq_index.name(i)}: {bad} (will be skipped)")
+        if len(invalid) > 10: self.log_status(f"... {len(invalid) - 10} more invalid record(s)")
+        self.root.after_idle(self._do_show_loaded_file, seq_index, preview)
+
+    def _do_show_loaded_file(self, seq_index: SequenceIndex, preview: str):
+        if self.seq_index is not None: self.seq_index.close()
+        else: self.sequence_var.set(self.sequence_text.get("1.0", tk.END).strip()) # Keep pasted text for Clear File
+        self.seq_index = seq_index
+        self.sequence_text.config(state=tk.NORMAL)
+        self.sequence_text.delete("1.0", tk.END); self.sequence_text.insert(tk.END, preview)
+        self.sequence_text.config(state=tk.DISABLED)
+        self._finish_run()
+
+    def clear_sequence_file(self):
+        if self.seq_index is not None: self.seq_index.close(); self.seq_index = None
+        self.sequence_text.config(state=tk.NORMAL)
+        self.sequence_text.delete("1.0", tk.END); self.sequence_text.insert(tk.END, self.sequence_var.get())
+        self.clear_file_button.config(state=tk.DISABLED)
+
+    def _selection_settings(self) -> Tuple[bool, str, int, int, str, set]:
+        """Current hit-selection settings; raises ValueError (or TclError) if a spinbox holds a non-integer."""
+        excluded_clades = {c.strip().lower() for c in self.exclude_clades_var.get().split(",") if c.strip()}
+        return (self.exclude_landoltia_var.get(), self.def_format_var.get(), int(self.max_detail_hits_var.get()),
+                int(self.target_results_var.get()), self.diversity_level_var.get(), excluded_clades)
+
+    def _set_busy(self, busy: bool):
+        """Run, Load and Clear File are disabled together while a run, re-selection or file load
+        is in progress, so the loaded file's map is never closed or replaced under a worker."""
+        state = tk.DISABLED if busy else tk.NORMAL
+        self.run_button.config(state=state); self.load_file_button.config(state=state)
+        self.clear_file_button.config(state=tk.NORMAL if not busy and self.seq_index is not None else tk.DISABLED)
 
     def start_blast_thread(self):
-        self.run_button.config(state=tk.DISABLED)
+        self._set_busy(True)
         self.log_status("Initiating BLAST search...")
         self.clear_results_tree()
+        try: settings = self._selection_settings()
+        except (ValueError, tk.TclError):
+            messagebox.showerror("Input Error", "Max Detail Hits and Target Final Results must be integers.")
+            self._set_busy(False); return
+        self.sessions, self._reselect_pending = [], False
+
+        databases = self._selected_databases()
+        if self.seq_index is not None:
+            self._set_result_columns(batch=True, multi_db=isinstance(databases, list))
+            params = (self.seq_index, self.program_var.get(), databases) + settings
+            self.log_status(f"Batch: {len(self.seq_index)} record(s) from {self.seq_index.path}, Prog={params[1]}, DB={params[2]}")
+            threading.Thread(target=self._orchestrate_batch_search, args=params, daemon=True).start()
+            return
+
         current_sequence = self.sequence_text.get("1.0", tk.END).strip()
         if not current_sequence:
             messagebox.showerror("Input Error", "Sequence cannot be empty.")
-            self.run_button.config(state=tk.NORMAL); return
-        try:
-            max_hits = int(self.max_detail_hits_var.get())
-            target_res = int(self.target_results_var.get())
-        except ValueError:
-            messagebox.showerror("Input Error", "Max Detail Hits and Target Final Results must be integers.")
-            self.run_button.config(state=tk.NORMAL); return
-
-        params = (current_sequence, self.program_var.get(), self.database_var.get(),
-                  self.exclude_landoltia_var.get(), self.def_format_var.get(),
-                  max_hits, target_res)
-        self.log_status(f"Params: Prog={params[1]}, DB={params[2]}, SeqLen={len(params[0])}, ExclLand={params[3]}, DefFmt={params[4]}, MaxHits={params[5]}, TargetRes={params[6]}")
+            self._set_busy(False); return
+        self._set_result_columns(batch=False, multi_db=isinstance(databases, list))
+        params = (current_sequence, self.program_var.get(), databases) + settings
+        self.log_status(f"Params: Prog={params[1]}, DB={params[2]}, SeqLen={len(params[0])}, ExclLand={params[3]}, DefFmt={params[4]}, MaxHits={params[5]}, TargetRes={params[6]}, PerLevel={params[7]}, ExclClades={sorted(params[8])}")
 
         thread = threading.Thread(target=self._orchestrate_blast_search, args=params, daemon=True)
         thread.start()
@@ -222,123 +290,103 @@ class BlastApp:
         self.status_text.see(tk.END)
         self.status_text.config(state=tk.DISABLED)
 
-    def _submit_blast_search(self, sequence: str, database: str, program: str) -> str:
-        self.log_status(f"Submitting BLAST {program} to {database}...")
-        params = {"CMD": "Put", "PROGRAM": program, "DATABASE": database, "QUERY": sequence, "FORMAT_TYPE": DEFAULT_BLAST_FORMAT_TYPE}
-        if program == "blastn" and database == "nt": params["NO_DATABASE_OVERRIDE"] = "true"
-        if program == "blastx": params["FILTER"] = "F"
-        response = requests.post(NCBI_BLAST_API_URL, params=params)
-        response.raise_for_status()
-        rid = None
-        for line in response.text.splitlines():
-            if "RID =" in line: rid = line.split("RID =")[1].strip().split(" ")[0]; break
-        if not rid:
-            try:
-                root = ET.fromstring(response.content)
-                q_node = root if root.tag=='QBlastInfo' else root.find(".//QBlastInfo")
-                if q_node is not None: rid_el = q_node.find('Rid'); rid = rid_el.text.strip() if rid_el is not None and rid_el.text else None
-            except ET.ParseError as e: self.log_status(f"XML ParseError (RID): {e}")
-        if not rid: self.log_status(f"Error: No RID. Resp: {response.text[:200]}"); raise ValueError("No RID")
-        self.log_status(f"Search submitted. RID: {rid}"); return rid
-
-    def _check_blast_status(self, rid: str) -> str:
-        self.log_status(f"Checking status for RID: {rid}...")
-        params = {"CMD": "Get", "RID": rid, "FORMAT_OBJECT": "SearchInfo"}
-        response = requests.get(NCBI_BLAST_API_URL, params=params); response.raise_for_status()
-        status, px = "UNKNOWN", False
-        try:
-            root = ET.fromstring(response.content)
-            q_node = root if root.tag == 'QBlastInfo' else root.find(".//QBlastInfo")
-            if q_node is not None: stat_el = q_node.find('Status'); status = stat_el.text.strip().upper() if stat_el is not None and stat_el.text else "UNKNOWN"; px=True
-        except ET.ParseError as e: self.log_status(f"XML ParseError (Status): {e}")
-        if not px and "Status=" in response.text:
-            for line in response.text.splitlines():
-                if "Status=" in line: status = line.split("Status=")[1].strip().split(" ")[0].split("<")[0].strip().upper(); break
-        self.log_status(f"Status for {rid}: {status}"); return status
-
-    def _get_blast_results_xml(self, rid: str) -> str:
-        self.log_status(f"Retrieving results for RID: {rid}..."); params = {"CMD": "Get", "RID": rid, "FORMAT_TYPE": DEFAULT_BLAST_FORMAT_TYPE}
-        response = requests.get(NCBI_BLAST_API_URL, params=params); response.raise_for_status()
-        self.log_status("Results XML retrieved."); return response.text
-
-    def _parse_blast_xml_to_hits(self, xml_results: str, query_sequence: str) -> List[BlastHit]:
-        self.log_status("Parsing BLAST XML results..."); hits: List[BlastHit] = []
-        try:
-            root = ET.fromstring(xml_results)
-            for iter_node in root.findall('.//Iteration'):
-                for hit_xml in iter_node.findall('.//Hit'):
-                    hit_id = hit_xml.findtext('Hit_id', "")
-                    acc_id = parse_ncbi_hit_id_static(hit_id)
-                    acc_tag = hit_xml.findtext('Hit_accession')
-                    accession = acc_id if "." in acc_id and acc_id!="N/A" else acc_tag or acc_id or "N/A"
-                    hsp = hit_xml.find('.//Hsp')
-                    if hsp:
-                        qf, qt = hsp.findtext('Hsp_query-from'), hsp.findtext('Hsp_query-to')
-                        qsb, qeb = "N/A", "N/A"
-                        if qf and qt and query_sequence:
-                            try: q_f,q_t=int(qf),int(qt); qsb=query_sequence[q_f-1] if 0<q_f<=len(query_sequence) else "N/A"; qeb=query_sequence[q_t-1] if 0<q_t<=len(query_sequence) else "N/A"
-                            except: pass
-                        hits.append(BlastHit(accession=accession, hit_def_raw=hit_xml.findtext('Hit_def'), query_start=qf, query_start_base=qsb, query_end=qt, query_end_base=qeb, e_value=hsp.findtext('Hsp_evalue')))
-        except ET.ParseError as e: self.log_status(f"XML ParseError (Hits): {e}")
-        self.log_status(f"Parsed {len(hits)} initial hits."); return hits
-
-    def _fetch_sequence_details(self, accession: str, db_type: str) -> Dict[str, str]:
-        self.log_status(f"Fetching details for {accession} (db: {db_type})...")
-        if not accession or accession=="N/A": return {"Definition":"N/A", "Organism":"N/A"}
-        params = {"db":db_type, "id":accession, "rettype":"gb", "retmode":"text"}
+    def _run_query(self, current_sequence, program, database, exclude_landoltia, def_format, max_detail_hits,
+                   target_results, diversity_level="organism", excluded_clades=None, query_name=None) -> Tuple[int, List[BlastHit]]:
+        """Runs one query through the local pipeline, or through the job server in thin-client mode.
+        Selected hits are shown as they arrive. Returns (initial hit count, final results)."""
+        on_hit = lambda hit: self.root.after_idle(self._do_display_hit_in_tree, hit)
+        if self.server_url:
+            return self._run_remote_query({"sequence": current_sequence, "program": program, "database": database,
+                                           "exclude_landoltia": exclude_landoltia, "def_format": def_format,
+                                           "max_detail_hits": max_detail_hits, "target_results": target_results,
+                                           "diversity_level": diversity_level, "excluded_clades": sorted(excluded_clades or []),
+                                           "query_name": query_name}, on_hit)
+        session, final_results = self.pipeline.run_query(current_sequence, program, database, exclude_landoltia, def_format,
+                                                         max_detail_hits, target_results, diversity_level, excluded_clades,
+                                                         query_name=query_name, on_hit=on_hit)
+        self.sessions.append(session)
+        return len(session.initial_hits), final_results
+
+    def _run_remote_query(self, job: Dict[str, object], on_hit) -> Tuple[int, List[BlastHit]]:
+        """Submits the job to the server and follows it until done."""
+        job_id = self._post_remote_job("/jobs", job)
+        self.log_status(f"Submitted to server as job {job_id}.")
+        result = self._follow_remote_job(job_id, on_hit)
+        self.sessions.append(job_id)
+        return result
+
+    def _post_remote_job(self, path: str, body: Dict[str, object]) -> str:
+        resp = requests.post(f"{self.server_url}{path}", json=body, timeout=REMOTE_REQUEST_TIMEOUT_SECONDS)
+        if resp.status_code in (400, 409): raise ValueError(resp.json().get("error", resp.text))
+        resp.raise_for_status()
+        return resp.json()["job_id"]
+
+    def _follow_remote_job(self, job_id: str, on_hit) -> Tuple[int, List[BlastHit]]:
+        """Long-polls a server job's events, relaying log lines and hits, until it is done."""
+        since, final_results = 0, []
+        while True:
+            resp = requests.get(f"{self.server_url}/jobs/{job_id}/events", params={"since": since, "wait": REMOTE_LONG_POLL_SECONDS},
+                                timeout=REMOTE_LONG_POLL_SECONDS + REMOTE_REQUEST_TIMEOUT_SECONDS)
+            resp.raise_for_status()
+            for event in resp.json()["events"]:
+                since = event["seq"] + 1
+                if event["type"] == "log": self.log_status(event["message"])
+                elif event["type"] == "hit": hit = BlastHit.from_dict(event["hit"]); final_results.append(hit); on_hit(hit)
+                elif event["type"] == "done": return event["initial_hit_count"], final_results
+                elif event["type"] == "error": raise Exception(f"Server job {job_id} failed: {event['message']}")
+
+    def _schedule_reselect(self, *_):
+        """Trace callback for the selection settings; debounced so typing in a spinbox or entry triggers one pass."""
+        if self._reselect_after_id: self.root.after_cancel(self._reselect_after_id)
+        self._reselect_after_id = self.root.after(RESELECT_DEBOUNCE_MS, self._start_reselect)
+
+    def _start_reselect(self):
+        self._reselect_after_id = None
+        if not self.sessions: return
+        if str(self.run_button.cget("state")) == tk.DISABLED: self._reselect_pending = True; return # Picked up in _finish_run
+        try: settings = self._selection_settings()
+        except (ValueError, tk.TclError): return # Spinbox mid-edit; the next valid value reschedules
+        self._set_busy(True)
+        self.clear_results_tree()
+        self.log_status(f"Re-selecting hits: ExclLand={settings[0]}, DefFmt={settings[1]}, MaxHits={settings[2]}, TargetRes={settings[3]}, PerLevel={settings[4]}, ExclClades={sorted(settings[5])}")
+        threading.Thread(target=self._orchestrate_reselect, args=(list(self.sessions), settings), daemon=True).start()
+
+    def _orchestrate_reselect(self, sessions: List[object], settings):
+        """Re-applies selection to the last run's hits; only accessions not fetched before hit the network."""
+        exclude_landoltia, def_format, max_detail_hits, target_results, diversity_level, excluded_clades = settings
+        on_hit = lambda hit: self.root.after_idle(self._do_display_hit_in_tree, hit)
+        displayed = 0
         try:
-            resp = requests.get(NCBI_EUTILS_EFETCH_URL, params=params); resp.raise_for_status()
-            content, def_lines, org, cap_def = resp.text, [], "N/A", False
-            for line in content.splitlines():
-                if line.startswith("DEFINITION"): def_lines.append(line[10:].strip()); cap_def=True
-                elif cap_def:
-                    if line.startswith(("ACCESSION","VERSION","KEYWORDS","SOURCE")) or line.strip().startswith("ORGANISM"): cap_def=False
-                    else: def_lines.append(line.strip())
-                if line.strip().startswith("ORGANISM"): parts=line.split("ORGANISM",1); org=parts[1].strip() if len(parts)>1 else "N/A"
-            return {"Definition":" ".join(def_lines) or "N/A", "Organism":org}
-        except requests.exceptions.RequestException as e: self.log_status(f"HTTP Err {accession}: {e}"); return {"Definition":"Err fetch", "Organism":"Err fetch"}
-        except Exception as e: self.log_status(f"Parse Err {accession}: {e}"); return {"Definition":"Err parse", "Organism":"Err parse"}
+            for session in sessions:
+                if isinstance(session, SearchSession):
+                    displayed += len(self.pipeline.select_hits(session, exclude_landoltia, def_format, max_detail_hits, target_results,
+                                                               diversity_level, excluded_clades, on_hit=on_hit))
+                    continue
+                selection_id = self._post_remote_job(f"/jobs/{session}/select", {
+                    "exclude_landoltia": exclude_landoltia, "def_format": def_format, "max_detail_hits": max_detail_hits,
+                    "target_results": target_results, "diversity_level": diversity_level, "excluded_clades": sorted(excluded_clades)})
+                displayed += len(self._follow_remote_job(selection_id, on_hit)[1])
+            self.log_status(f"Re-selection complete. Displayed {displayed} hits.")
+        except requests.exceptions.RequestException as e: self.log_status(f"Net/HTTP Err during re-selection: {e}")
+        except Exception as e: self.log_status(f"Re-selection error: {e}")
+        finally:
+            self.root.after_idle(self._finish_run)
+
+    def _finish_run(self):
+        """Re-enables the controls and applies any selection change made while the worker was busy."""
+        self._set_busy(False)
+        if self._reselect_pending: self._reselect_pending = False; self._schedule_reselect()
+
+    def _log_http_stats(self):
+        if self.pipeline: self.log_status(f"HTTP stats: {self.pipeline.http.stats.summary()}")
 
     def _orchestrate_blast_search(self, current_sequence, program, database, exclude_landoltia,
-                                 def_format, max_detail_hits, target_results):
+                                 def_format, max_detail_hits, target_results, diversity_level="organism", excluded_clades=None):
         self.log_status("Orchestrating BLAST search...")
         try:
-            rid = self._submit_blast_search(current_sequence, database, program)
-            poll_count, unknown_status_count = 0,0
-            while True:
-                poll_count+=1
-                if poll_count > MAX_TOTAL_POLLS: self.log_status(f"Max polls ({MAX_TOTAL_POLLS})"); raise Exception(f"Max polls.")
-                status = self._check_blast_status(rid)
-                if status == "READY": break
-                if status in ["FAILED", "ERROR"]: self.log_status(f"Search {rid} failed: {status}"); raise Exception(f"Search failed: {status}")
-                if status == "UNKNOWN": unknown_status_count+=1;
-                if unknown_status_count >= BLAST_MAX_UNKNOWN_RETRIES: self.log_status("Too many UNKNOWNs"); raise Exception("Too many UNKNOWNs.")
-                else: unknown_status_count=0
-                # self.root.update_idletasks() # Less critical now, GUI updates are scheduled
-                time.sleep(BLAST_POLL_INTERVAL_SECONDS)
-
-            xml_data = self._get_blast_results_xml(rid)
-            initial_hits = self._parse_blast_xml_to_hits(xml_data, current_sequence)
-            if not initial_hits: self.log_status("No initial hits."); self.root.after_idle(lambda: messagebox.showinfo("BLAST Complete", "No hits found.")); return
-
-            final_results, selected_orgs = [], set()
-            db_type = "protein" if program == "blastx" else "nuccore"
-            for i, hit in enumerate(initial_hits[:max_detail_hits]):
-                if len(final_results) >= target_results: break
-                self.log_status(f"Processing hit {i+1}/{len(initial_hits[:max_detail_hits])}: {hit.accession}")
-                details = self._fetch_sequence_details(hit.accession, db_type)
-                hit.organism, hit.definition = details["Organism"], details["Definition"]
-                if def_format == "short" and hit.hit_def_raw and hit.hit_def_raw!="N/A": hit.definition = hit.hit_def_raw.split(" [")[0] or details["Definition"]
-
-                if "Err" in hit.organism or "Err" in hit.definition: self.log_status(f"Skip {hit.accession} (detail err)"); time.sleep(NCBI_API_REQUEST_DELAY_SECONDS); continue
-                if exclude_landoltia and hit.organism == "Landoltia punctata": self.log_status(f"Skip {hit.accession} (Landoltia)"); continue
-                if hit.organism and hit.organism != "N/A" and hit.organism in selected_orgs: self.log_status(f"Skip {hit.accession} (org selected)"); continue
-
-                final_results.append(hit)
-                if hit.organism and hit.organism != "N/A" and "Err" not in hit.organism: selected_orgs.add(hit.organism)
-                self.root.after_idle(self._do_display_hit_in_tree, hit)
-                time.sleep(NCBI_API_REQUEST_DELAY_SECONDS)
-
+            initial_count, final_results = self._run_query(current_sequence, program, database, exclude_landoltia,
+                                                           def_format, max_detail_hits, target_results, diversity_level, excluded_clades)
+            if not initial_count: self.root.after_idle(lambda: messagebox.showinfo("BLAST Complete", "No hits found.")); return
             self.log_status(f"BLAST complete. Displayed {len(final_results)} hits.")
             if not final_results: self.root.after_idle(lambda: messagebox.showinfo("BLAST Complete", "No suitable hits after filtering."))
         except requests.exceptions.RequestException as e: self.log_status(f"Net/HTTP Err: {e}"); self.root.after_idle(lambda: messagebox.showerror("Network Error", f"{e}"))
@@ -347,13 +395,48 @@ class BlastApp:
             self.log_status(f"Unexpected error: {e}")
             import traceback; tb_str=traceback.format_exc(); self.log_status(tb_str)
             self.root.after_idle(lambda: messagebox.showerror("Error", f"{e}\n\n{tb_str[:500]}..."))
-        finally: self.root.after_idle(lambda: self.run_button.config(state=tk.NORMAL))
+        finally:
+            self._log_http_stats()
+            self.root.after_idle(self._finish_run)
+
+    def _orchestrate_batch_search(self, seq_index: SequenceIndex, program, database, exclude_landoltia,
+                                  def_format, max_detail_hits, target_results, diversity_level="organism", excluded_clades=None):
+        """Runs every record of a loaded file, BATCH_CONCURRENT_RECORDS at a time (NCBI request rates
+        are still enforced by the pipeline's rate limiter). Each sequence is read from the memory-mapped
+        index only when its search is submitted; a failing record is logged and skipped."""
+        def run_record(i: int) -> Optional[int]:
+            name = seq_index.name(i)
+            try:
+                bad = seq_index.invalid_residues(i)
+                if bad: self.log_status(f"Skip record {name} (invalid residues: {bad.decode('ascii', 'replace')})"); return None
+                sequence = seq_index.get_sequence(i)
+                if not sequence: self.log_status(f"Skip record {name} (empty)"); return None
+                self.log_status(f"Batch record {i+1}/{len(seq_index)}: {name} ({len(sequence)} nt)")
+                _, final_results = self._run_query(sequence, program, database, exclude_landoltia,
+                                                   def_format, max_detail_hits, target_results, diversity_level,
+                                                   excluded_clades, query_name=name)
+                return len(final_results)
+            except requests.exceptions.RequestException as e: self.log_status(f"Net/HTTP Err ({name}): {e}")
+            except Exception as e: self.log_status(f"Error ({name}): {e}")
+            return None
+
+        done, failed, displayed = 0, 0, 0
+        try:
+            with ThreadPoolExecutor(max_workers=BATCH_CONCURRENT_RECORDS, thread_name_prefix="blast-batch") as executor:
+                for shown in executor.map(run_record, range(len(seq_index))):
+                    if shown is None: failed+=1
+                    else: done+=1; displayed+=shown
+            self.log_status(f"Batch complete. {done} searched, {failed} failed/skipped, {displayed} hits displayed.")
+            self.root.after_idle(lambda: messagebox.showinfo("Batch Complete", f"{done} searched, {failed} failed/skipped, {displayed} hits displayed."))
+        finally:
+            self._log_http_stats()
+            self.root.after_idle(self._finish_run)
 
     def clear_results_tree(self):
         for item in self.results_tree.get_children(): self.results_tree.delete(item)
 
     def _do_display_hit_in_tree(self, hit: BlastHit):
-        formatted_e = format_evalue_static(hit.e_value if hit.e_value is not None else "N/A")
+        formatted_e = hit.e_value_formatted or format_evalue_static(hit.e_value if hit.e_value is not None else "N/A")
         q_start = f"{hit.query_start_base or ''}{hit.query_start or 'N/A'}"
         q_end = f"{hit.query_end_base or ''}{hit.query_end or 'N/A'}"
 
@@ -361,10 +444,18 @@ class BlastApp:
         if len(display_def) > 240: # Truncate long definitions for Treeview
             display_def = display_def[:237] + "..."
 
-        self.results_tree.insert("", tk.END, values=(hit.accession or "N/A", display_def,
-                                                      hit.organism or "N/A", q_start, q_end, formatted_e))
+        self.results_tree.insert("", tk.END, values=(hit.query_name or "", hit.accession or "N/A", display_def,
+                                                      hit.organism or "N/A", q_start, q_end, formatted_e,
+                                                      ", ".join(hit.databases or [])))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NCBI BLAST GUI client.")
+    parser.add_argument("--server", default=os.environ.get("BLAST_SERVER_URL"),
+                        help="run jobs on a server.py instance (e.g. http://127.0.0.1:8765) instead of locally")
+    args = parser.parse_args()
     root = tk.Tk()
-    app = BlastApp(root)
-    root.mainloop()
+    app = BlastApp(root, server_url=args.server)
+    try: root.mainloop()
+    finally:
+        shutdown_parse_pool()
+        if app.pipeline: app.pipeline.close()
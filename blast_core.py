@@ -0,0 +1,183 @@
+"""Tkinter-free core of the BLAST client: hit model, parsing helpers and the parse pool.
+
+Kept separate from app.py so worker processes (and anything headless) can import it
+without pulling in tkinter.
+"""
+import multiprocessing
+import os
+import threading
+import warnings
+import xml.etree.ElementTree as ET
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, List, Tuple
+
+# --- Configuration Constants ---
+def _env_worker_count(name: str) -> Optional[int]:
+    """Positive integer from the environment; unset, 0 or invalid -> None (os.cpu_count())."""
+    value = os.environ.get(name, "").strip()
+    if not value: return None
+    try: count = int(value)
+    except ValueError: count = -1
+    if count < 0: warnings.warn(f"Ignoring {name}={value!r}; expected a positive integer. Using one worker per CPU core.")
+    return count if count > 0 else None
+
+# Number of worker processes used to parse BLAST XML. 0/unset -> os.cpu_count().
+PARSE_POOL_MAX_WORKERS = _env_worker_count("BLAST_PARSE_WORKERS")
+# Workers are never forked from the (multi-threaded) GUI/server process; fork there can deadlock the child.
+PARSE_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Field order of the compact per-hit records returned by parse workers.
+HIT_RECORD_FIELDS = ("accession", "hit_def_raw", "query_start", "query_start_base",
+                     "query_end", "query_end_base", "e_value", "e_value_formatted")
+
+# --- Data Model (BlastHit) ---
+class BlastHit:
+    def __init__(self, accession: Optional[str] = None, hit_def_raw: Optional[str] = None,
+                 definition: Optional[str] = None, organism: Optional[str] = None,
+                 query_start: Optional[str] = None, query_start_base: Optional[str] = None,
+                 query_end: Optional[str] = None, query_end_base: Optional[str] = None,
+                 e_value: Optional[str] = None, hsp_details: Optional[Dict[str, any]] = None,
+                 e_value_formatted: Optional[str] = None, query_name: Optional[str] = None,
+                 taxid: Optional[int] = None, databases: Optional[List[str]] = None):
+        self.accession = accession
+        self.hit_def_raw = hit_def_raw
+        self.definition = definition
+        self.organism = organism
+        self.query_start = query_start
+        self.query_start_base = query_start_base
+        self.query_end = query_end
+        self.query_end_base = query_end_base
+        self.e_value = e_value
+        self.e_value_formatted = e_value_formatted
+        self.hsp_details = hsp_details if hsp_details is not None else {}
+        self.query_name = query_name # Source record name for batch (file) runs
+        self.taxid = taxid
+        self.databases = databases # Databases that returned this accession (provenance in multi-database runs)
+    @classmethod
+    def from_record(cls, record: Tuple) -> "BlastHit":
+        return cls(**dict(zip(HIT_RECORD_FIELDS, record)))
+    @classmethod
+    def from_dict(cls, data: Dict[str, any]) -> "BlastHit":
+        return cls(**data)
+    def to_dict(self) -> Dict[str, any]:
+        """JSON-safe copy of the hit (used for caching and the job server API)."""
+        data = dict(vars(self))
+        data["hsp_details"], data["databases"] = dict(self.hsp_details), list(self.databases) if self.databases else None
+        return data
+    def __repr__(self):
+        return (f"BlastHit(accession='{self.accession}', organism='{self.organism}', "
+                f"e_value='{self.e_value}', definition='{self.definition[:30] if self.definition else 'N/A'}...')")
+
+# --- Helper Functions ---
+def format_evalue_static(e_value_str: str) -> str:
+    if not e_value_str: return "N/A"
+    try:
+        e_value_float = float(e_value_str)
+        if e_value_float == 0.0: return "0"
+        sci_notation = f"{e_value_float:e}"
+        parts = sci_notation.split('e')
+        significand_str, exponent_val = parts[0], int(parts[1])
+        rounded_digit = round(float(significand_str))
+        if abs(rounded_digit) >= 10:
+            exponent_val += 1
+            rounded_digit /= 10
+        return f"{int(rounded_digit)}e{exponent_val}"
+    except: return e_value_str
+
+def parse_ncbi_hit_id_static(hit_id_text: str) -> str:
+    if not hit_id_text: return "N/A"
+    parts = hit_id_text.split('|')
+    known_prefixes = ["ref", "pdb", "sp", "gb", "emb", "dbj", "prf", "tpg"]
+    if len(parts) >= 4 and parts[2] in known_prefixes: return parts[3]
+    if len(parts) >= 2 and parts[0] in known_prefixes: return parts[1]
+    if len(parts) == 1 and not any(p in hit_id_text for p in [f"{pref}|" for pref in known_prefixes] + ["gi|"]): return hit_id_text
+    if parts:
+        potential_acc = parts[-1].strip()
+        if potential_acc: return potential_acc
+        if len(parts) > 1 and parts[-2].strip(): return parts[-2].strip()
+    return hit_id_text
+
+def evalue_sort_key(e_value_str: Optional[str]) -> float:
+    try: return float(e_value_str)
+    except (TypeError, ValueError): return float("inf")
+
+def merge_ranked_hits(hits_by_db: Dict[str, List[BlastHit]]) -> List[BlastHit]:
+    """Merges per-database hit lists into one list ranked by e-value, deduplicated by
+    accession.version. The best-scoring copy is kept and its databases list records every
+    database the accession came from. Ties keep per-database rank order."""
+    merged: Dict[str, BlastHit] = {}
+    for db, hits in hits_by_db.items():
+        for hit in hits:
+            key = hit.accession if hit.accession and hit.accession != "N/A" else f"{db}:{id(hit)}"
+            kept = merged.get(key)
+            if kept is None: merged[key] = hit; hit.databases = [db]; continue
+            dbs = kept.databases + [d for d in [db] if d not in kept.databases]
+            if evalue_sort_key(hit.e_value) < evalue_sort_key(kept.e_value): merged[key] = hit
+            merged[key].databases = dbs
+    ranks = {id(hit): i for hits in hits_by_db.values() for i, hit in enumerate(hits)}
+    return sorted(merged.values(), key=lambda h: (evalue_sort_key(h.e_value), ranks[id(h)]))
+
+# --- XML Parsing (runs inside parse worker processes) ---
+def parse_blast_xml_records(xml_results: str, query_sequence: str) -> Tuple[List[Tuple], Optional[str]]:
+    """Parses BLAST XML into compact hit records (see HIT_RECORD_FIELDS).
+    Returns (records, error_message); error_message is None when the XML parsed cleanly."""
+    records: List[Tuple] = []
+    try:
+        root = ET.fromstring(xml_results)
+        for iter_node in root.findall('.//Iteration'):
+            for hit_xml in iter_node.findall('.//Hit'):
+                hit_id = hit_xml.findtext('Hit_id', "")
+                acc_id = parse_ncbi_hit_id_static(hit_id)
+                acc_tag = hit_xml.findtext('Hit_accession')
+                accession = acc_id if "." in acc_id and acc_id!="N/A" else acc_tag or acc_id or "N/A"
+                hsp = hit_xml.find('.//Hsp')
+                if hsp is not None:
+                    qf, qt = hsp.findtext('Hsp_query-from'), hsp.findtext('Hsp_query-to')
+                    qsb, qeb = "N/A", "N/A"
+                    if qf and qt and query_sequence:
+                        try: q_f,q_t=int(qf),int(qt); qsb=query_sequence[q_f-1] if 0<q_f<=len(query_sequence) else "N/A"; qeb=query_sequence[q_t-1] if 0<q_t<=len(query_sequence) else "N/A"
+                        except: pass
+                    e_value = hsp.findtext('Hsp_evalue')
+                    records.append((accession, hit_xml.findtext('Hit_def'), qf, qsb, qt, qeb, e_value,
+                                    format_evalue_static(e_value if e_value is not None else "N/A")))
+    except ET.ParseError as e: return records, str(e)
+    return records, None
+
+# --- Parse Pool ---
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
+def get_parse_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """Returns the shared parse pool, creating it on first use."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=max_workers or PARSE_POOL_MAX_WORKERS,
+                                              mp_context=multiprocessing.get_context(PARSE_POOL_START_METHOD))
+        return _parse_pool
+
+def shutdown_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        pool, _parse_pool = _parse_pool, None
+    if pool is not None: pool.shutdown(wait=False, cancel_futures=True)
+
+def submit_blast_xml_parse(xml_results: str, query_sequence: str, max_workers: Optional[int] = None) -> Future:
+    """Queues parse_blast_xml_records on the process pool so large results don't hold the caller's
+    GIL. If the pool cannot be used the parse runs in-process and a completed future is returned."""
+    try: return get_parse_pool(max_workers).submit(parse_blast_xml_records, xml_results, query_sequence)
+    except (BrokenProcessPool, OSError, RuntimeError):
+        shutdown_parse_pool() # Next submit starts a fresh pool
+        future = Future(); future.set_result(parse_blast_xml_records(xml_results, query_sequence)); return future
+
+def collect_blast_xml_parse(future: Future, xml_results: str, query_sequence: str) -> Tuple[List[Tuple], Optional[str]]:
+    """Waits for a submitted parse; re-parses in-process if its worker died or the pool was shut down."""
+    try: return future.result()
+    except (BrokenProcessPool, CancelledError):
+        shutdown_parse_pool()
+        return parse_blast_xml_records(xml_results, query_sequence)
+
+def parse_blast_xml_in_pool(xml_results: str, query_sequence: str,
+                            max_workers: Optional[int] = None) -> Tuple[List[Tuple], Optional[str]]:
+    return collect_blast_xml_parse(submit_blast_xml_parse(xml_results, query_sequence, max_workers), xml_results, query_sequence)
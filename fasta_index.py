@@ -0,0 +1,144 @@
+"""Memory-mapped FASTA/FASTQ ingestion.
+
+SequenceIndex maps a sequence file (gzip files are streamed to a temporary file first)
+and records the byte offsets of each record, so large multi-sequence inputs never have
+to be loaded into the GUI. Sequences are sliced out of the map only when requested.
+"""
+import gzip
+import mmap
+import os
+import shutil
+import tempfile
+import zlib
+from typing import List, Optional, Tuple
+
+# IUPAC nucleotide codes plus gap; blastn and blastx both take nucleotide queries.
+NUCLEOTIDE_ALPHABET = b"ACGTURYSWKMBDHVN-" + b"ACGTURYSWKMBDHVN-".lower()
+WHITESPACE = b" \t\r\n"
+GZIP_MAGIC = b"\x1f\x8b"
+GZIP_STREAM_CHUNK_BYTES = 1 << 20
+SCAN_CHUNK_BYTES = 1 << 20 # Validation and length scans copy at most this much of a record at a time
+
+
+class SequenceIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self.records: List[Tuple[str, int, int]] = []  # (name, seq_start, seq_end) byte offsets
+        self._file = self._open_mappable(path)
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close(); raise ValueError(f"{os.path.basename(path)} is empty.")
+        try:
+            start = self._skip_preamble()
+            first = self._mm[start:start + 1]
+            if first == b">": self.format = "fasta"; self._index_fasta(start)
+            elif first == b"@": self.format = "fastq"; self._index_fastq(start)
+            elif not first: raise ValueError(f"{os.path.basename(path)} contains no records.")
+            else: raise ValueError(f"{os.path.basename(path)} is not FASTA or FASTQ (starts with {first!r}).")
+        except Exception: self.close(); raise
+
+    @staticmethod
+    def _open_mappable(path: str):
+        """Returns a binary file object backed by a real file; gzip input is streamed
+        in chunks into an anonymous temporary file so it can be mapped."""
+        with open(path, "rb") as fh: is_gzip = fh.read(2) == GZIP_MAGIC
+        if not is_gzip: return open(path, "rb")
+        tmp = tempfile.TemporaryFile()
+        try:
+            with gzip.open(path, "rb") as gz: shutil.copyfileobj(gz, tmp, GZIP_STREAM_CHUNK_BYTES)
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e: # Truncated or corrupt archive
+            tmp.close(); raise ValueError(f"{os.path.basename(path)} is not a readable gzip file: {e}") from e
+        tmp.flush(); return tmp
+
+    def _skip_preamble(self) -> int:
+        """Offset of the first record, past leading blank lines and ';' comment lines."""
+        mm, size, pos = self._mm, len(self._mm), 0
+        while pos < size:
+            c = mm[pos:pos + 1]
+            if c == b";": nl = mm.find(b"\n", pos); pos = size if nl == -1 else nl + 1
+            elif c in WHITESPACE: pos += 1
+            else: break
+        return pos
+
+    def _index_fasta(self, pos: int = 0):
+        mm, size = self._mm, len(self._mm)
+        while pos < size:
+            header_end = mm.find(b"\n", pos)
+            if header_end == -1: header_end = size
+            name = mm[pos + 1:header_end].decode("utf-8", "replace").strip()
+            next_rec = mm.find(b"\n>", header_end)
+            seq_end = next_rec if next_rec != -1 else size
+            self.records.append((name, min(header_end + 1, size), seq_end))
+            if next_rec == -1: break
+            pos = next_rec + 1
+
+    def _index_fastq(self, pos: int = 0):
+        mm, size = self._mm, len(self._mm)
+        while pos < size:
+            header_end = mm.find(b"\n", pos)
+            seq_end = mm.find(b"\n", header_end + 1) if header_end != -1 else -1
+            plus_end = mm.find(b"\n", seq_end + 1) if seq_end != -1 else -1
+            if plus_end == -1: raise ValueError(f"Truncated FASTQ record at byte {pos}.")
+            qual_end = mm.find(b"\n", plus_end + 1)
+            name = mm[pos + 1:header_end].decode("utf-8", "replace").strip()
+            self.records.append((name, header_end + 1, seq_end))
+            if qual_end == -1: break
+            pos = qual_end + 1
+            while pos < size and mm[pos:pos + 1] in (b"\n", b"\r"): pos += 1
+
+    def __len__(self): return len(self.records)
+
+    def name(self, i: int) -> str: return self.records[i][0]
+
+    def _chunks(self, i: int, size: int = SCAN_CHUNK_BYTES):
+        _, start, end = self.records[i]
+        for pos in range(start, end, size): yield self._mm[pos:min(pos + size, end)]
+
+    def sequence_length(self, i: int) -> int:
+        """Residue count of record i (whitespace excluded), without copying the record out of the map."""
+        return sum(len(chunk) - sum(chunk.count(c) for c in WHITESPACE) for chunk in self._chunks(i))
+
+    def sequence_head(self, i: int, width: int) -> bytes:
+        """The first width residues of record i; only about that many bytes are read."""
+        head = b""
+        for chunk in self._chunks(i, max(2 * width, 256)):
+            head += chunk.translate(None, WHITESPACE)
+            if len(head) >= width: break
+        return head[:width]
+
+    def raw_sequence(self, i: int) -> bytes:
+        _, start, end = self.records[i]
+        return self._mm[start:end].translate(None, WHITESPACE)
+
+    def get_sequence(self, i: int) -> str:
+        return self.raw_sequence(i).decode("ascii", "replace")
+
+    def invalid_residues(self, i: int, alphabet: bytes = NUCLEOTIDE_ALPHABET) -> bytes:
+        """Returns the distinct residues of record i outside the alphabet (empty if valid).
+        bytes.translate does the per-residue work in C, so this stays fast on large records."""
+        bad = set()
+        for chunk in self._chunks(i): bad.update(chunk.translate(None, alphabet + WHITESPACE))
+        return bytes(sorted(bad))
+
+    def validate(self, alphabet: bytes = NUCLEOTIDE_ALPHABET) -> List[Tuple[int, str]]:
+        """Returns (record index, offending residues) for every record that fails validation."""
+        invalid = []
+        for i in range(len(self.records)):
+            bad = self.invalid_residues(i, alphabet)
+            if bad or not self.sequence_length(i): invalid.append((i, bad.decode("ascii", "replace") or "<empty>"))
+        return invalid
+
+    def preview(self, max_records: int = 5, width: int = 60) -> str:
+        lengths = [self.sequence_length(i) for i in range(len(self.records))]
+        lines = [f"# {os.path.basename(self.path)}: {len(self.records)} {self.format.upper()} record(s), {sum(lengths)} residues"]
+        for i in range(min(max_records, len(self.records))):
+            snippet = self.sequence_head(i, width).decode("ascii", "replace") + ("..." if lengths[i] > width else "")
+            lines.append(f">{self.name(i)} ({lengths[i]} nt)\n{snippet}")
+        if len(self.records) > max_records: lines.append(f"# ... {len(self.records) - max_records} more record(s)")
+        return "\n".join(lines)
+
+    def close(self):
+        mm: Optional[mmap.mmap] = getattr(self, "_mm", None)
+        if mm is not None: mm.close(); self._mm = None
+        if not self._file.closed: self._file.close()
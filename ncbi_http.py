@@ -0,0 +1,254 @@
+"""Resilient HTTP access to NCBI: classified retries, backoff, circuit breakers and hedging.
+
+Idempotent calls (BLAST Get, EFetch) are retried on timeouts, connection errors, 429 and
+5xx. The non-idempotent BLAST Put is only retried when NCBI cannot have accepted the
+submission (connect failures, 429/503 rejections), so a retry never queues a duplicate
+search. Each endpoint has its own circuit breaker, and slow idempotent calls can be
+hedged with one duplicate request. A per-endpoint token bucket keeps all traffic from
+one client (and so every job sharing it) within NCBI's request-rate guidance. Counters
+are kept in ResilienceStats.
+"""
+import email.utils
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 10
+DEFAULT_READ_TIMEOUT_SECONDS = 60
+BREAKER_FAILURE_THRESHOLD = 5      # Consecutive failed requests (each after all its retries) before an endpoint's breaker opens
+BREAKER_RESET_SECONDS = 60         # Time an open breaker waits before allowing a trial request
+HEDGE_DELAY_SECONDS = 3.0          # Send a duplicate EFetch if the first hasn't answered by then
+MAX_LATENCY_SAMPLES = 1000
+# Per-endpoint (requests per second, burst). Unlisted endpoints are not throttled.
+DEFAULT_RATE_LIMITS = {"blast-put": (0.1, 3), "blast-get": (1.0, 5), "efetch": (3.0, 3)}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without touching the network while an endpoint's breaker is open."""
+
+
+class RetryPolicy:
+    def __init__(self, name: str, max_attempts: int, base_delay: float, max_delay: float,
+                 retry_statuses: frozenset, retry_exceptions: tuple):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+        self.retry_exceptions = retry_exceptions
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff; a server Retry-After takes precedence (capped)."""
+        if retry_after is not None: return min(max(retry_after, 0.0), self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+IDEMPOTENT_POLICY = RetryPolicy("idempotent", max_attempts=5, base_delay=1.0, max_delay=30.0,
+                                retry_statuses=frozenset({429, 500, 502, 503, 504}),
+                                retry_exceptions=(requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+NON_IDEMPOTENT_POLICY = RetryPolicy("non-idempotent", max_attempts=3, base_delay=2.0, max_delay=30.0,
+                                    retry_statuses=frozenset({429, 503}),
+                                    retry_exceptions=(requests.exceptions.ConnectTimeout,))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value: return None
+    value = value.strip()
+    if value.isdigit(): return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError): return None
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def admit(self) -> Optional[str]:
+        """Returns "closed" when requests flow normally, "trial" for the single probe let through
+        while half-open, or None if the caller must be rejected (open, or a probe is in flight)."""
+        with self._lock:
+            state = self.state
+            if state == "closed": return "closed"
+            if state == "half-open" and not self._trial_in_flight: self._trial_in_flight = True; return "trial"
+            return None
+
+    def release_trial(self):
+        """Frees the probe slot if the probe ended without recording success or failure."""
+        with self._lock: self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock: self.failures, self.opened_at, self._trial_in_flight = 0, None, False
+
+    def record_failure(self) -> bool:
+        """Returns True if this failure opened (or re-opened) the breaker."""
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic(); return True
+            return False
+
+
+class RateLimiter:
+    """Token bucket; acquire() blocks until a token is available."""
+    def __init__(self, rate: float, burst: int):
+        self.rate, self.burst = rate, burst
+        self._tokens, self._updated = float(burst), time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Takes one token and returns the time spent waiting for it."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1: self._tokens -= 1; return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay); waited += delay
+
+
+class ResilienceStats:
+    COUNTERS = ("requests", "attempts", "retries", "failures", "breaker_rejections", "breaker_opens", "hedges_sent", "hedges_won", "throttled")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._job_latencies: List[float] = []
+        self._failed_jobs = 0
+
+    def incr(self, endpoint: str, counter: str, n: int = 1):
+        with self._lock:
+            counts = self._counts.setdefault(endpoint, dict.fromkeys(self.COUNTERS, 0))
+            counts[counter] += n
+
+    def record_job_latency(self, seconds: float, failed: bool = False):
+        """Every job is sampled, failed or not, so the percentiles aren't biased towards good runs."""
+        with self._lock:
+            self._failed_jobs += failed
+            self._job_latencies.append(seconds)
+            del self._job_latencies[:-MAX_LATENCY_SAMPLES]
+
+    def snapshot(self) -> Dict[str, object]:
+        """Per-endpoint counters plus p50/p99 of recent job latencies (seconds)."""
+        with self._lock:
+            latencies = sorted(self._job_latencies)
+            pct = lambda p: round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 2) if latencies else None
+            return {"endpoints": {k: dict(v) for k, v in self._counts.items()},
+                    "jobs": len(latencies), "jobs_failed": self._failed_jobs, "job_p50_s": pct(0.50), "job_p99_s": pct(0.99)}
+
+    def summary(self) -> str:
+        snap = self.snapshot()
+        parts = [f"{ep}: " + ", ".join(f"{k}={v}" for k, v in c.items() if v) for ep, c in snap["endpoints"].items()]
+        return "; ".join(parts) + (f"; jobs={snap['jobs']} failed={snap['jobs_failed']} p50={snap['job_p50_s']}s p99={snap['job_p99_s']}s" if snap["jobs"] else "")
+
+
+class NcbiHttpClient:
+    def __init__(self, log: Optional[Callable[[str], None]] = None, hedge_delay: Optional[float] = HEDGE_DELAY_SECONDS,
+                 timeout=(DEFAULT_CONNECT_TIMEOUT_SECONDS, DEFAULT_READ_TIMEOUT_SECONDS), rate_limits=None):
+        self.log = log or (lambda message: None)
+        self.hedge_delay = hedge_delay  # None disables hedging
+        self.timeout = timeout
+        self.stats = ResilienceStats()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._breakers_lock = threading.Lock()
+        limits = DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits
+        self._limiters = {endpoint: RateLimiter(rate, burst) for endpoint, (rate, burst) in limits.items()}
+        self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ncbi-hedge")
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        with self._breakers_lock: return self._breakers.setdefault(endpoint, CircuitBreaker())
+
+    def get(self, endpoint: str, url: str, params: dict, policy: RetryPolicy = IDEMPOTENT_POLICY, hedge: bool = False) -> requests.Response:
+        return self._request(endpoint, "GET", url, params, policy, hedge)
+
+    def post(self, endpoint: str, url: str, params: dict, policy: RetryPolicy = NON_IDEMPOTENT_POLICY) -> requests.Response:
+        return self._request(endpoint, "POST", url, params, policy, hedge=False)
+
+    def _send(self, endpoint: str, method: str, url: str, params: dict) -> requests.Response:
+        limiter = self._limiters.get(endpoint)
+        if limiter and limiter.acquire() > 0: self.stats.incr(endpoint, "throttled")
+        return requests.request(method, url, params=params, timeout=self.timeout)
+
+    def _send_hedged(self, endpoint: str, method: str, url: str, params: dict) -> requests.Response:
+        """Sends the request; if no answer arrives within hedge_delay, sends one duplicate
+        and returns whichever completes first (an exception only if both fail)."""
+        primary = self._hedge_pool.submit(self._send, endpoint, method, url, params)
+        done, _ = wait([primary], timeout=self.hedge_delay)
+        if done: return primary.result()
+        self.stats.incr(endpoint, "hedges_sent")
+        hedge = self._hedge_pool.submit(self._send, endpoint, method, url, params)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [fut for fut in done if fut.exception() is None]
+            if succeeded:
+                if primary not in succeeded: self.stats.incr(endpoint, "hedges_won")
+                return succeeded[0].result()
+        return primary.result()  # Both failed; surface the primary's error
+
+    def _request(self, endpoint: str, method: str, url: str, params: dict, policy: RetryPolicy, hedge: bool) -> requests.Response:
+        breaker = self.breaker(endpoint)
+        self.stats.incr(endpoint, "requests")
+        admitted = breaker.admit()
+        if admitted is None: self._reject(endpoint, breaker)
+        try: return self._attempts(endpoint, method, url, params, policy, hedge, breaker, trial=admitted == "trial")
+        finally:
+            if admitted == "trial": breaker.release_trial()
+
+    def _reject(self, endpoint: str, breaker: CircuitBreaker):
+        self.stats.incr(endpoint, "breaker_rejections")
+        raise CircuitOpenError(f"{endpoint} circuit open after repeated failures; retry in {breaker.reset_seconds}s")
+
+    def _attempts(self, endpoint: str, method: str, url: str, params: dict, policy: RetryPolicy, hedge: bool,
+                  breaker: CircuitBreaker, trial: bool) -> requests.Response:
+        """Retry loop for one admitted request. Retries stop if another request opens the breaker
+        meanwhile; the half-open probe keeps its retries."""
+        for attempt in range(1, policy.max_attempts + 1):
+            if attempt > 1 and not trial and breaker.state == "open": self._reject(endpoint, breaker)
+            self.stats.incr(endpoint, "attempts")
+            response, retry_after, error = None, None, None
+            try:
+                response = self._send_hedged(endpoint, method, url, params) if hedge and self.hedge_delay is not None else self._send(endpoint, method, url, params)
+            except policy.retry_exceptions as e: error = e
+            except requests.exceptions.RequestException: self._record_failure(endpoint, breaker); raise
+            if response is not None:
+                if response.status_code not in policy.retry_statuses:
+                    if response.status_code >= 500: self._record_failure(endpoint, breaker)
+                    else: breaker.record_success()  # 4xx is the caller's problem, not the endpoint's
+                    response.raise_for_status(); return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                error = requests.exceptions.HTTPError(f"{response.status_code} from {endpoint}", response=response)
+            self.stats.incr(endpoint, "failures")
+            if attempt == policy.max_attempts: # The breaker counts requests, not attempts, so one bad RID can't open it alone
+                if breaker.record_failure(): self.stats.incr(endpoint, "breaker_opens")
+                raise error
+            delay = policy.backoff(attempt, retry_after)
+            self.stats.incr(endpoint, "retries")
+            self.log(f"{endpoint} {method} failed ({error}); retry {attempt}/{policy.max_attempts - 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _record_failure(self, endpoint: str, breaker: CircuitBreaker):
+        self.stats.incr(endpoint, "failures")
+        if breaker.record_failure(): self.stats.incr(endpoint, "breaker_opens")
+
+    def close(self):
+        self._hedge_pool.shutdown(wait=False, cancel_futures=True)
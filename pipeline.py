@@ -0,0 +1,329 @@
+"""Tkinter-free BLAST search pipeline: submit, poll, parse, enrich and select hits.
+
+BlastPipeline is shared by the GUI (app.py) and the headless job server (server.py). One
+instance owns the NCBI HTTP client (retries, rate limits), the optional local indexes and
+the details/results caches, so every job that runs through it shares them.
+"""
+import hashlib
+import os
+import re
+import threading
+from contextlib import contextmanager
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from concurrent.futures import Future
+
+from blast_core import BlastHit, merge_ranked_hits, submit_blast_xml_parse, collect_blast_xml_parse
+from taxonomy import TaxonomyIndex
+from accession_index import AccessionIndex, LocalRecord
+from ncbi_http import NcbiHttpClient, CircuitOpenError, IDEMPOTENT_POLICY, NON_IDEMPOTENT_POLICY
+
+# --- Configuration Constants ---
+NCBI_BLAST_API_URL = "https://blast.ncbi.nlm.nih.gov/Blast.cgi"
+NCBI_EUTILS_EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+DEFAULT_BLAST_FORMAT_TYPE = "XML"
+BLAST_POLL_INTERVAL_SECONDS = 10
+BLAST_MAX_UNKNOWN_RETRIES = 5
+NCBI_API_REQUEST_DELAY_SECONDS = 1
+MAX_TOTAL_POLLS = 180 # Approx 30 minutes (180 polls * 10s/poll)
+TAXONOMY_INDEX_PATH = os.environ.get("BLAST_TAXONOMY_INDEX", "taxonomy.taxidx") # Built with `python taxonomy.py build ...`
+ACCESSION_INDEX_PATH = os.environ.get("BLAST_ACCESSION_INDEX", "accessions.accidx") # Built with `python accession_index.py build ...`
+EFETCH_HEDGE_DELAY_SECONDS = float(os.environ.get("BLAST_EFETCH_HEDGE_SECONDS", "3") or 0) or None # 0 disables hedged EFetch
+DETAILS_CACHE_SIZE = 50_000 # EFetch results kept per pipeline (LRU)
+RESULTS_CACHE_SIZE = 200 # Parsed BLAST results kept per (program, database, sequence) (LRU)
+RESULTS_CACHE_TTL_SECONDS = 6 * 3600
+GENBANK_TAXON_RE = re.compile(r'/db_xref="taxon:(\d+)"')
+
+
+class LruCache:
+    """Small thread-safe LRU mapping with an optional per-entry TTL."""
+    def __init__(self, max_size: int, ttl_seconds: Optional[float] = None):
+        self.max_size, self.ttl_seconds = max_size, ttl_seconds
+        self.hits = self.misses = 0
+        self._data: "OrderedDict[object, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (self.ttl_seconds and time.monotonic() - entry[0] > self.ttl_seconds):
+                self._data.pop(key, None); self.misses += 1; return None
+            self._data.move_to_end(key); self.hits += 1; return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value); self._data.move_to_end(key)
+            while len(self._data) > self.max_size: self._data.popitem(last=False)
+
+    def __len__(self): return len(self._data)
+
+
+class SearchSession:
+    """A completed search kept in memory for re-selection: the parsed (and, for multi-database
+    runs, merged) hits plus every hit's successfully fetched details, keyed by accession."""
+    def __init__(self, sequence: str, program: str, databases: List[str], initial_hits: List[BlastHit], query_name: Optional[str] = None):
+        self.sequence = sequence
+        self.program = program
+        self.databases = databases
+        self.initial_hits = initial_hits
+        self.query_name = query_name
+        self.details: Dict[str, Dict[str, object]] = {}
+
+    @property
+    def db_type(self) -> str: return "protein" if self.program == "blastx" else "nuccore"
+
+
+class BlastPipeline:
+    def __init__(self, log: Optional[Callable[[str], None]] = None, http: Optional[NcbiHttpClient] = None,
+                 taxonomy: Optional[TaxonomyIndex] = None, accession_index: Optional[AccessionIndex] = None):
+        self._default_log = log or print
+        self._local = threading.local() # Per-thread log sink, so concurrent jobs keep separate logs
+        self.http = http or NcbiHttpClient(log=self.log, hedge_delay=EFETCH_HEDGE_DELAY_SECONDS)
+        self.taxonomy = taxonomy
+        self.accession_index = accession_index
+        self.details_cache = LruCache(DETAILS_CACHE_SIZE)
+        self.results_cache = LruCache(RESULTS_CACHE_SIZE, RESULTS_CACHE_TTL_SECONDS)
+
+    @classmethod
+    def from_environment(cls, log: Optional[Callable[[str], None]] = None) -> "BlastPipeline":
+        """Creates a pipeline with the taxonomy/accession indexes configured by environment, if present."""
+        pipeline = cls(log=log)
+        try: pipeline.taxonomy = TaxonomyIndex.open_optional(TAXONOMY_INDEX_PATH)
+        except (OSError, ValueError) as e: pipeline.log(f"Taxonomy index Err: {e}")
+        if pipeline.taxonomy: pipeline.log(f"Taxonomy index loaded: {TAXONOMY_INDEX_PATH} (max taxid {pipeline.taxonomy.max_taxid}).")
+        else: pipeline.log("No taxonomy index; per-organism selection uses organism names only.")
+        try: pipeline.accession_index = AccessionIndex.open_optional(ACCESSION_INDEX_PATH)
+        except (OSError, ValueError) as e: pipeline.log(f"Accession index Err: {e}")
+        if pipeline.accession_index: pipeline.log(f"Accession index loaded: {ACCESSION_INDEX_PATH} ({pipeline.accession_index.count} accessions).")
+        return pipeline
+
+    def log(self, message):
+        (getattr(self._local, "log", None) or self._default_log)(message)
+
+    @contextmanager
+    def job_log(self, log: Callable[[str], None]):
+        """Routes this thread's log messages to log for the duration of a job."""
+        previous = getattr(self._local, "log", None)
+        self._local.log = log
+        try: yield
+        finally: self._local.log = previous
+
+    def stats(self) -> Dict[str, object]:
+        snap = self.http.stats.snapshot()
+        snap["details_cache"] = {"size": len(self.details_cache), "hits": self.details_cache.hits, "misses": self.details_cache.misses}
+        snap["results_cache"] = {"size": len(self.results_cache), "hits": self.results_cache.hits, "misses": self.results_cache.misses}
+        return snap
+
+    def close(self):
+        if self.taxonomy: self.taxonomy.close()
+        if self.accession_index: self.accession_index.close()
+        self.http.close()
+
+    def submit_blast_search(self, sequence: str, database: str, program: str) -> str:
+        self.log(f"Submitting BLAST {program} to {database}...")
+        params = {"CMD": "Put", "PROGRAM": program, "DATABASE": database, "QUERY": sequence, "FORMAT_TYPE": DEFAULT_BLAST_FORMAT_TYPE}
+        if program == "blastn" and database == "nt": params["NO_DATABASE_OVERRIDE"] = "true"
+        if program == "blastx": params["FILTER"] = "F"
+        response = self.http.post("blast-put", NCBI_BLAST_API_URL, params, NON_IDEMPOTENT_POLICY)
+        rid = None
+        for line in response.text.splitlines():
+            if "RID =" in line: rid = line.split("RID =")[1].strip().split(" ")[0]; break
+        if not rid:
+            try:
+                root = ET.fromstring(response.content)
+                q_node = root if root.tag=='QBlastInfo' else root.find(".//QBlastInfo")
+                if q_node is not None: rid_el = q_node.find('Rid'); rid = rid_el.text.strip() if rid_el is not None and rid_el.text else None
+            except ET.ParseError as e: self.log(f"XML ParseError (RID): {e}")
+        if not rid: self.log(f"Error: No RID. Resp: {response.text[:200]}"); raise ValueError("No RID")
+        self.log(f"Search submitted. RID: {rid}"); return rid
+
+    def check_blast_status(self, rid: str) -> str:
+        self.log(f"Checking status for RID: {rid}...")
+        params = {"CMD": "Get", "RID": rid, "FORMAT_OBJECT": "SearchInfo"}
+        response = self.http.get("blast-get", NCBI_BLAST_API_URL, params, IDEMPOTENT_POLICY)
+        status, px = "UNKNOWN", False
+        try:
+            root = ET.fromstring(response.content)
+            q_node = root if root.tag == 'QBlastInfo' else root.find(".//QBlastInfo")
+            if q_node is not None: stat_el = q_node.find('Status'); status = stat_el.text.strip().upper() if stat_el is not None and stat_el.text else "UNKNOWN"; px=True
+        except ET.ParseError as e: self.log(f"XML ParseError (Status): {e}")
+        if not px and "Status=" in response.text:
+            for line in response.text.splitlines():
+                if "Status=" in line: status = line.split("Status=")[1].strip().split(" ")[0].split("<")[0].strip().upper(); break
+        self.log(f"Status for {rid}: {status}"); return status
+
+    def get_blast_results_xml(self, rid: str) -> str:
+        self.log(f"Retrieving results for RID: {rid}..."); params = {"CMD": "Get", "RID": rid, "FORMAT_TYPE": DEFAULT_BLAST_FORMAT_TYPE}
+        response = self.http.get("blast-get", NCBI_BLAST_API_URL, params, IDEMPOTENT_POLICY)
+        self.log("Results XML retrieved."); return response.text
+
+    def parse_blast_xml_to_hits(self, xml_results: str, query_sequence: str) -> List[BlastHit]:
+        self.log("Parsing BLAST XML results...")
+        return self.collect_parsed_hits(submit_blast_xml_parse(xml_results, query_sequence), xml_results, query_sequence)[0]
+
+    def collect_parsed_hits(self, future: Future, xml_results: str, query_sequence: str) -> Tuple[List[BlastHit], Optional[str]]:
+        """Waits for a parse queued with submit_blast_xml_parse; returns (hits, parse error or None).
+        On a parse error the hits are those read before it."""
+        records, parse_error = collect_blast_xml_parse(future, xml_results, query_sequence)
+        if parse_error: self.log(f"XML ParseError (Hits): {parse_error}")
+        hits = [BlastHit.from_record(rec) for rec in records]
+        self.log(f"Parsed {len(hits)} initial hits."); return hits, parse_error
+
+    def fetch_sequence_details(self, accession: str, db_type: str, local_record: Optional[LocalRecord] = None) -> Dict[str, str]:
+        """Definition, organism and taxid for an accession. "Source" says where they came from:
+        "local" (indexes), "cache", "efetch" (a network call was made, even if it failed) or "none"."""
+        if not accession or accession=="N/A": return {"Definition":"N/A", "Organism":"N/A", "TaxId":None, "Source":"none"}
+        if local_record is None and self.accession_index: local_record = self.accession_index.lookup(accession)
+        local_taxid, local_title = local_record if local_record else (0, "")
+        local_org = self.taxonomy.name(local_taxid) if self.taxonomy and local_taxid else None
+        if local_title and local_org: # Both resolved offline; no EFetch needed
+            self.log(f"Local details for {accession}.")
+            return {"Definition":local_title, "Organism":local_org, "TaxId":local_taxid, "Source":"local"}
+        cached = self.details_cache.get((db_type, accession))
+        if cached: self.log(f"Cached details for {accession}."); return dict(cached, Source="cache")
+        self.log(f"Fetching details for {accession} (db: {db_type})...")
+        params = {"db":db_type, "id":accession, "rettype":"gb", "retmode":"text"}
+        try:
+            resp = self.http.get("efetch", NCBI_EUTILS_EFETCH_URL, params, IDEMPOTENT_POLICY, hedge=True)
+            content, def_lines, org, cap_def = resp.text, [], "N/A", False
+            taxon_match = GENBANK_TAXON_RE.search(content)
+            for line in content.splitlines():
+                if line.startswith("DEFINITION"): def_lines.append(line[10:].strip()); cap_def=True
+                elif cap_def:
+                    if line.startswith(("ACCESSION","VERSION","KEYWORDS","SOURCE")) or line.strip().startswith("ORGANISM"): cap_def=False
+                    else: def_lines.append(line.strip())
+                if line.strip().startswith("ORGANISM"): parts=line.split("ORGANISM",1); org=parts[1].strip() if len(parts)>1 else "N/A"
+            details = {"Definition":" ".join(def_lines) or "N/A", "Organism":org, "TaxId":int(taxon_match.group(1)) if taxon_match else local_taxid or None}
+            self.details_cache.put((db_type, accession), details); return dict(details, Source="efetch")
+        except CircuitOpenError as e: self.log(f"HTTP Err {accession}: {e}"); return {"Definition":"Err fetch", "Organism":"Err fetch", "TaxId":None, "Source":"none"} # Nothing was sent
+        except requests.exceptions.RequestException as e: self.log(f"HTTP Err {accession}: {e}"); return {"Definition":"Err fetch", "Organism":"Err fetch", "TaxId":None, "Source":"efetch"}
+        except Exception as e: self.log(f"Parse Err {accession}: {e}"); return {"Definition":"Err parse", "Organism":"Err parse", "TaxId":None, "Source":"efetch"}
+
+    def run_query(self, current_sequence, program, database, exclude_landoltia,
+                  def_format, max_detail_hits, target_results, diversity_level="organism",
+                  excluded_clades=None, query_name=None,
+                  on_hit: Optional[Callable[[BlastHit], None]] = None) -> Tuple["SearchSession", List[BlastHit]]:
+        """Submits one query (to one database, or to a list of databases at once), waits for it,
+        then fetches details and selects hits. Each selected hit is passed to on_hit as soon as it is
+        accepted. Returns (session, final_results); the session can be re-selected later with
+        select_hits. Network and search failures propagate to the caller."""
+        started, succeeded = time.monotonic(), False
+        try:
+            databases = [database] if isinstance(database, str) else list(database)
+            hits_by_db = self.search_databases(current_sequence, program, databases)
+            initial_hits = hits_by_db[databases[0]] if len(databases) == 1 else merge_ranked_hits(hits_by_db)
+            if len(databases) > 1: self.log(f"Merged {sum(len(h) for h in hits_by_db.values())} hits from {len(hits_by_db)} database(s) into {len(initial_hits)} unique.")
+            for hit in initial_hits: hit.query_name = query_name
+            session = SearchSession(current_sequence, program, databases, initial_hits, query_name)
+            if not initial_hits: self.log("No initial hits."); succeeded = True; return session, []
+            final_results = self.select_hits(session, exclude_landoltia, def_format, max_detail_hits, target_results,
+                                             diversity_level, excluded_clades, on_hit)
+            succeeded = True
+            return session, final_results
+        finally: self.http.stats.record_job_latency(time.monotonic() - started, failed=not succeeded)
+
+    def select_hits(self, session: "SearchSession", exclude_landoltia, def_format, max_detail_hits, target_results,
+                    diversity_level="organism", excluded_clades=None,
+                    on_hit: Optional[Callable[[BlastHit], None]] = None) -> List[BlastHit]:
+        """Applies the selection rules to a session's hits. Details already in the session are
+        reused, so only hits newly pulled into range (e.g. a higher max_detail_hits) are fetched."""
+        final_results, selected_keys = [], set()
+        in_range = session.initial_hits[:max_detail_hits]
+        missing = [h.accession for h in in_range if h.accession not in session.details]
+        local_records = self.accession_index.lookup_many(missing) if self.accession_index and missing else {}
+        for i, hit in enumerate(in_range):
+            if len(final_results) >= target_results: break
+            details, fetched = session.details.get(hit.accession), False
+            if details is None:
+                self.log(f"Processing hit {i+1}/{len(in_range)}: {hit.accession}")
+                details = self.fetch_sequence_details(hit.accession, session.db_type, local_records.get(hit.accession, (0, "")))
+                fetched = details.get("Source") == "efetch"
+                if "Err" not in details["Organism"] and "Err" not in details["Definition"]: session.details[hit.accession] = details
+            hit.organism, hit.definition, hit.taxid = details["Organism"], details["Definition"], details["TaxId"]
+            if self.taxonomy and hit.taxid: hit.organism = self.taxonomy.name(hit.taxid) or hit.organism
+            if def_format == "short" and hit.hit_def_raw and hit.hit_def_raw!="N/A": hit.definition = hit.hit_def_raw.split(" [")[0] or details["Definition"]
+
+            if "Err" in hit.organism or "Err" in hit.definition:
+                self.log(f"Skip {hit.accession} (detail err)")
+                if fetched: time.sleep(NCBI_API_REQUEST_DELAY_SECONDS)
+                continue
+            if exclude_landoltia and hit.organism == "Landoltia punctata": self.log(f"Skip {hit.accession} (Landoltia)"); continue
+            if excluded_clades and self._in_excluded_clade(hit, excluded_clades): self.log(f"Skip {hit.accession} (excluded clade)"); continue
+            diversity_key = self._diversity_key(hit, diversity_level)
+            if diversity_key and diversity_key in selected_keys: self.log(f"Skip {hit.accession} ({diversity_level} selected)"); continue
+
+            final_results.append(hit)
+            if diversity_key: selected_keys.add(diversity_key)
+            if on_hit: on_hit(hit)
+            if fetched: time.sleep(NCBI_API_REQUEST_DELAY_SECONDS)
+        return final_results
+
+    def search_databases(self, current_sequence, program, databases: List[str]) -> Dict[str, List[BlastHit]]:
+        """Submits the query to every database, then polls all RIDs in the same rounds, so the
+        wait is roughly that of the slowest database. Results are parsed in the pool as each RID
+        becomes ready, while the rest are still polled. A poll that fails after its retries counts
+        as an UNKNOWN status, and one rejected by an open circuit breaker is simply skipped, so
+        queued searches outlive NCBI outages. A database that fails is logged and dropped; the
+        last failure is raised only if none succeed."""
+        rids, hits_by_db, parsing, last_error = {}, {}, {}, None
+        seq_digest = hashlib.sha1(current_sequence.encode("utf-8")).hexdigest()
+        for db in databases:
+            cached = self.results_cache.get((program, db, seq_digest))
+            if cached is not None:
+                self.log(f"Using cached {program} results for {db} ({len(cached)} hits).")
+                hits_by_db[db] = [BlastHit.from_dict(d) for d in cached]; continue
+            try: rids[db] = self.submit_blast_search(current_sequence, db, program)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if len(databases) == 1: raise
+                self.log(f"Submit to {db} failed: {e}"); last_error = e
+        unknown_counts, poll_count = dict.fromkeys(rids, 0), 0
+        while rids:
+            poll_count+=1
+            if poll_count > MAX_TOTAL_POLLS: self.log(f"Max polls ({MAX_TOTAL_POLLS})"); last_error = Exception(f"Max polls."); break
+            for db, rid in list(rids.items()):
+                try:
+                    try:
+                        status = self.check_blast_status(rid)
+                        if status == "READY":
+                            xml_results = self.get_blast_results_xml(rid)
+                            del rids[db]
+                            self.log(f"Parsing {db} BLAST XML results...")
+                            parsing[db] = (submit_blast_xml_parse(xml_results, current_sequence), xml_results)
+                            continue
+                    except CircuitOpenError as e: self.log(f"Poll of {rid} skipped: {e}"); continue
+                    except requests.exceptions.RequestException as e: self.log(f"Poll of {rid} missed: {e}"); status = "UNKNOWN"
+                    if status in ["FAILED", "ERROR"]: self.log(f"Search {rid} failed: {status}"); raise Exception(f"Search failed: {status}")
+                    if status == "UNKNOWN":
+                        unknown_counts[db]+=1
+                        if unknown_counts[db] >= BLAST_MAX_UNKNOWN_RETRIES: self.log("Too many UNKNOWNs"); raise Exception("Too many UNKNOWNs.")
+                    else: unknown_counts[db]=0
+                except Exception as e:
+                    if len(databases) == 1: raise
+                    rids.pop(db, None); self.log(f"{db} dropped: {e}"); last_error = e
+            if rids: time.sleep(BLAST_POLL_INTERVAL_SECONDS)
+        for db, (future, xml_results) in parsing.items():
+            hits_by_db[db], parse_error = self.collect_parsed_hits(future, xml_results, current_sequence)
+            for hit in hits_by_db[db]: hit.databases = [db]
+            if parse_error: self.log(f"{db} results not cached (incomplete XML)."); continue # Never serve a truncated result set from cache
+            self.results_cache.put((program, db, seq_digest), [hit.to_dict() for hit in hits_by_db[db]])
+        if not hits_by_db: raise last_error or Exception("No database returned results.")
+        return hits_by_db
+
+    def _diversity_key(self, hit: BlastHit, diversity_level: str) -> Optional[str]:
+        """Key used for "one hit per ..." selection: the taxid of the hit's ancestor at the chosen
+        rank when the taxonomy index can resolve it, otherwise the organism name."""
+        if diversity_level != "organism" and self.taxonomy and hit.taxid:
+            ancestor = self.taxonomy.ancestor_at_rank(hit.taxid, diversity_level)
+            if ancestor: return f"{diversity_level}:{ancestor}"
+        if hit.organism and hit.organism != "N/A" and "Err" not in hit.organism: return hit.organism
+        return None
+
+    def _in_excluded_clade(self, hit: BlastHit, excluded_clades) -> bool:
+        if self.taxonomy and hit.taxid: return self.taxonomy.in_clade(hit.taxid, excluded_clades)
+        return bool(hit.organism) and hit.organism.lower() in excluded_clades
+
@@ -0,0 +1,270 @@
+"""Headless local job server exposing the BLAST pipeline over HTTP/JSON.
+
+All clients share one BlastPipeline (NCBI rate limits, retry/breaker state, details and
+results caches) and one job scheduler. Does not import tkinter. Usage:
+
+    python server.py [--host 127.0.0.1] [--port 8765] [--workers 4]
+
+API:
+    POST /jobs                         submit a job (JSON body, see JOB_DEFAULTS) -> {"job_id": ...}
+    GET  /jobs/<id>                    job state, selected hits and log so far
+    GET  /jobs/<id>/events?since=N&wait=S   long poll: events with seq >= N, waiting up to S seconds
+    GET  /jobs/<id>/stream             the same events as server-sent events
+    POST /jobs/<id>/select             re-apply selection settings (SELECTION_FIELDS) to a finished job's
+                                       stored hits without a new BLAST search -> {"job_id": ...} of a
+                                       selection job whose hit/done events are read like any other job's
+    GET  /stats                        shared HTTP counters, cache usage and job counts
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from blast_core import shutdown_parse_pool
+from pipeline import BlastPipeline, SearchSession
+from taxonomy import DIVERSITY_RANKS
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 4 # Jobs run concurrently; further jobs wait in the queue
+LONG_POLL_MAX_SECONDS = 30
+JOB_RETENTION_SECONDS = 3600 # Finished jobs are forgotten after this long
+MAX_REQUEST_BYTES = 10 * 1024 * 1024
+PROGRAMS = ("blastn", "blastx")
+DEF_FORMATS = ("full", "short")
+DIVERSITY_LEVELS = ("organism",) + tuple(DIVERSITY_RANKS)
+JOB_DEFAULTS = {"sequence": None, "program": "blastn", "database": "nt", "exclude_landoltia": False, "def_format": "full",
+                "max_detail_hits": 20, "target_results": 3, "diversity_level": "organism", "excluded_clades": [], "query_name": None}
+TERMINAL_STATES = ("done", "error")
+SELECTION_FIELDS = ("exclude_landoltia", "def_format", "max_detail_hits", "target_results", "diversity_level", "excluded_clades")
+
+
+class Job:
+    def __init__(self, params: Dict[str, object]):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params
+        self.state = "queued"
+        self.events: List[Dict[str, object]] = []
+        self.created, self.finished = time.time(), None
+        self.session: Optional[SearchSession] = None # Kept after the run for re-selection
+        self.select_lock = threading.Lock()
+        self._cond = threading.Condition()
+
+    def add_event(self, event_type: str, **data):
+        with self._cond:
+            self.events.append(dict(data, seq=len(self.events), type=event_type))
+            if event_type in TERMINAL_STATES: self.state, self.finished = event_type, time.time()
+            self._cond.notify_all()
+
+    def log(self, message: str): self.add_event("log", message=message)
+
+    def events_since(self, since: int, wait: float) -> List[Dict[str, object]]:
+        """Events with seq >= since, blocking up to wait seconds for one to arrive."""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.events) > since or self.state in TERMINAL_STATES, timeout=wait)
+            return self.events[since:]
+
+    def summary(self) -> Dict[str, object]:
+        with self._cond:
+            return {"job_id": self.id, "state": self.state, "params": self.params, "created": self.created, "finished": self.finished,
+                    "hits": [e["hit"] for e in self.events if e["type"] == "hit"],
+                    "log": [e["message"] for e in self.events if e["type"] == "log"],
+                    "error": next((e["message"] for e in self.events if e["type"] == "error"), None)}
+
+
+def validate_job_params(body: Dict[str, object]) -> Dict[str, object]:
+    """Fills defaults and checks a submitted job; raises ValueError with a client-facing message."""
+    unknown = set(body) - set(JOB_DEFAULTS)
+    if unknown: raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    params = dict(JOB_DEFAULTS, **body)
+    if not isinstance(params["sequence"], str) or not params["sequence"].strip(): raise ValueError("sequence is required.")
+    params["sequence"] = params["sequence"].strip()
+    if params["program"] not in PROGRAMS: raise ValueError(f"program must be one of {PROGRAMS}.")
+    if params["def_format"] not in DEF_FORMATS: raise ValueError(f"def_format must be one of {DEF_FORMATS}.")
+    if params["diversity_level"] not in DIVERSITY_LEVELS: raise ValueError(f"diversity_level must be one of {DIVERSITY_LEVELS}.")
+    if not isinstance(params["exclude_landoltia"], bool): raise ValueError("exclude_landoltia must be true or false.")
+    db = params["database"]
+    if not (isinstance(db, str) and db) and not (isinstance(db, list) and db and all(isinstance(d, str) and d for d in db)):
+        raise ValueError("database must be a name or a non-empty list of names.")
+    for field in ("max_detail_hits", "target_results"):
+        if not isinstance(params[field], int) or isinstance(params[field], bool) or params[field] < 1: raise ValueError(f"{field} must be a positive integer.")
+    if not isinstance(params["excluded_clades"], list): raise ValueError("excluded_clades must be a list.")
+    if params["query_name"] is not None and not isinstance(params["query_name"], str): raise ValueError("query_name must be a string or null.")
+    params["excluded_clades"] = sorted({str(c).strip().lower() for c in params["excluded_clades"] if str(c).strip()})
+    return params
+
+
+class JobManager:
+    def __init__(self, pipeline: BlastPipeline, workers: int = DEFAULT_WORKERS):
+        self.pipeline = pipeline
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blast-job")
+        # Selection jobs only fetch details, so they get their own workers instead of queueing behind BLAST polls
+        self._select_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blast-select")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, body: Dict[str, object]) -> Job:
+        job = Job(validate_job_params(body))
+        self._register(job)
+        self._executor.submit(self._run, job)
+        return job
+
+    def _register(self, job: Job):
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock: return self._jobs.get(job_id)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values(): counts[job.state] = counts.get(job.state, 0) + 1
+            return counts
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]: del self._jobs[job_id]
+
+    def _run(self, job: Job):
+        job.state = "running"
+        p = job.params
+        try:
+            with self.pipeline.job_log(job.log):
+                job.session, final_results = self.pipeline.run_query(
+                    p["sequence"], p["program"], p["database"], p["exclude_landoltia"], p["def_format"],
+                    p["max_detail_hits"], p["target_results"], p["diversity_level"], set(p["excluded_clades"]),
+                    query_name=p["query_name"], on_hit=lambda hit: job.add_event("hit", hit=hit.to_dict()))
+            job.add_event("done", initial_hit_count=len(job.session.initial_hits), final_count=len(final_results))
+        except Exception as e: job.add_event("error", message=f"{type(e).__name__}: {e}")
+
+    def reselect(self, job: Job, body: Dict[str, object]) -> Job:
+        """Queues a selection job that re-applies settings to a finished job's session. Its hits
+        stream as events like a search job's; only hits newly in range are fetched."""
+        unknown = set(body) - set(SELECTION_FIELDS)
+        if unknown: raise ValueError(f"Only selection fields can change: {', '.join(sorted(unknown))}")
+        selection = Job(dict(validate_job_params(dict({k: job.params[k] for k in JOB_DEFAULTS}, **body)), reselect_of=job.id))
+        selection.select_lock = job.select_lock # Selections of the same session run one at a time
+        self._register(selection)
+        self._select_executor.submit(self._run_select, selection, job.session)
+        return selection
+
+    def _run_select(self, job: Job, session: SearchSession):
+        job.state = "running"
+        p = job.params
+        try:
+            with job.select_lock, self.pipeline.job_log(job.log):
+                hits = self.pipeline.select_hits(session, p["exclude_landoltia"], p["def_format"], p["max_detail_hits"],
+                                                 p["target_results"], p["diversity_level"], set(p["excluded_clades"]),
+                                                 on_hit=lambda hit: job.add_event("hit", hit=hit.to_dict()))
+            job.session = session # The selection job can itself be re-selected
+            job.add_event("done", initial_hit_count=len(session.initial_hits), final_count=len(hits))
+        except Exception as e: job.add_event("error", message=f"{type(e).__name__}: {e}")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._select_executor.shutdown(wait=False, cancel_futures=True)
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    manager: JobManager = None # Set by make_server
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args): pass # Keep stdout for job-level logging only
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(body)))
+        self.end_headers(); self.wfile.write(body)
+
+    def _job_or_404(self, job_id: str) -> Optional[Job]:
+        job = self.manager.get(job_id)
+        if job is None: self._send_json(404, {"error": f"Unknown job {job_id}"})
+        return job
+
+    def do_POST(self):
+        parts = [p for p in urlparse(self.path).path.split("/") if p]
+        if parts != ["jobs"] and not (len(parts) == 3 and parts[0] == "jobs" and parts[2] == "select"):
+            return self._send_json(404, {"error": "Not found"})
+        try: length = int(self.headers.get("Content-Length") or 0)
+        except ValueError: length = -1
+        if length < 0: return self._send_json(400, {"error": "Invalid Content-Length"})
+        if length > MAX_REQUEST_BYTES: return self._send_json(413, {"error": "Request too large"})
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict): raise ValueError("Body must be a JSON object.")
+            if parts == ["jobs"]:
+                job = self.manager.submit(body)
+                return self._send_json(202, {"job_id": job.id, "state": job.state})
+            job = self._job_or_404(parts[1])
+            if job is None: return
+            if job.session is None: return self._send_json(409, {"error": f"Job {job.id} has no results to re-select (state: {job.state})"})
+            selection = self.manager.reselect(job, body)
+            self._send_json(202, {"job_id": selection.id, "state": selection.state, "reselect_of": job.id})
+        except ValueError as e: return self._send_json(400, {"error": str(e)}) # json.JSONDecodeError is a ValueError
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [p for p in url.path.split("/") if p]
+        if parts == ["health"]: return self._send_json(200, {"ok": True})
+        if parts == ["stats"]: return self._send_json(200, dict(self.manager.pipeline.stats(), job_states=self.manager.counts()))
+        if len(parts) < 2 or parts[0] != "jobs": return self._send_json(404, {"error": "Not found"})
+        job = self._job_or_404(parts[1])
+        if job is None: return
+        if len(parts) == 2: return self._send_json(200, job.summary())
+        try:
+            since = max(0, int(query.get("since", ["0"])[0]))
+            wait = min(max(0.0, float(query.get("wait", ["0"])[0])), LONG_POLL_MAX_SECONDS)
+        except ValueError: return self._send_json(400, {"error": "since and wait must be numbers"})
+        if parts[2:] == ["events"]:
+            events = job.events_since(since, wait)
+            return self._send_json(200, {"events": events, "next": since + len(events), "state": job.state})
+        if parts[2:] == ["stream"]: return self._stream(job, since)
+        self._send_json(404, {"error": "Not found"})
+
+    def _stream(self, job: Job, since: int):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream"); self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close"); self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                events = job.events_since(since, LONG_POLL_MAX_SECONDS)
+                for event in events:
+                    self.wfile.write(f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+                since += len(events)
+                if not events: self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+                if job.state in TERMINAL_STATES and since >= len(job.events): return
+        except (BrokenPipeError, ConnectionResetError): return
+
+
+def make_server(host: str, port: int, manager: JobManager) -> ThreadingHTTPServer:
+    handler = type("BoundJobRequestHandler", (JobRequestHandler,), {"manager": manager})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless BLAST job server.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="concurrent jobs")
+    args = parser.parse_args()
+    pipeline = BlastPipeline.from_environment(log=print)
+    manager = JobManager(pipeline, args.workers)
+    httpd = make_server(args.host, args.port, manager)
+    print(f"BLAST job server listening on http://{args.host}:{args.port} ({args.workers} workers)")
+    try: httpd.serve_forever()
+    except KeyboardInterrupt: pass
+    finally:
+        httpd.server_close(); manager.shutdown(); pipeline.close(); shutdown_parse_pool()
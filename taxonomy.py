@@ -0,0 +1,137 @@
+"""Local NCBI taxonomy index built from the taxdump files (nodes.dmp / names.dmp).
+
+The index file is a fixed-width record table addressed directly by taxid followed by a
+blob of scientific names, so it can be memory-mapped and every taxid -> name/rank/parent
+lookup is a single struct unpack. Build it once with:
+
+    python taxonomy.py build nodes.dmp names.dmp taxonomy.taxidx
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterable, List, Optional, Set
+
+TAXONOMY_INDEX_MAGIC = b"BTAXIDX1"
+# magic, max_taxid, rank table length, names blob offset
+_HEADER = struct.Struct("<8sIIQ")
+# parent taxid, name offset, name length, rank id
+_RECORD = struct.Struct("<IIHB")
+ROOT_TAXID = 1
+MAX_LINEAGE_DEPTH = 128  # Guards against cycles in a corrupt index
+
+DIVERSITY_RANKS = ["species", "genus", "family", "order", "class", "phylum"]
+
+
+def _read_dmp(path: str) -> Iterable[List[str]]:
+    with open(path, "r", encoding="utf-8", errors="replace") as fh:
+        for line in fh:
+            yield line.rstrip("\t|\n").split("\t|\t")
+
+
+def build_taxonomy_index(nodes_path: str, names_path: str, out_path: str) -> int:
+    """Builds the index file from taxdump nodes.dmp and names.dmp. Returns the record count."""
+    parents, ranks, rank_ids = {}, {}, {}
+    for fields in _read_dmp(nodes_path):
+        taxid = int(fields[0])
+        parents[taxid] = int(fields[1])
+        ranks[taxid] = rank_ids.setdefault(fields[2].strip(), len(rank_ids))
+    if len(rank_ids) > 255: raise ValueError("Too many distinct ranks for the index format.")
+    max_taxid = max(parents) if parents else 0
+
+    name_offsets, name_lengths, blob, blob_len = array("I", bytes(4 * (max_taxid + 1))), array("H", bytes(2 * (max_taxid + 1))), [], 0
+    for fields in _read_dmp(names_path):
+        if len(fields) < 4 or fields[3].strip() != "scientific name": continue
+        taxid = int(fields[0])
+        if taxid > max_taxid: continue
+        encoded = fields[1].strip().encode("utf-8")[:0xFFFF]
+        name_offsets[taxid], name_lengths[taxid] = blob_len, len(encoded)
+        blob.append(encoded); blob_len += len(encoded)
+
+    rank_table = "\n".join(sorted(rank_ids, key=rank_ids.get)).encode("utf-8")
+    table = bytearray(_RECORD.size * (max_taxid + 1))
+    for taxid, parent in parents.items():
+        _RECORD.pack_into(table, taxid * _RECORD.size, parent, name_offsets[taxid], name_lengths[taxid], ranks[taxid])
+    names_offset = _HEADER.size + len(rank_table) + len(table)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(_HEADER.pack(TAXONOMY_INDEX_MAGIC, max_taxid, len(rank_table), names_offset))
+        out.write(rank_table); out.write(table)
+        for chunk in blob: out.write(chunk)
+    os.replace(tmp_path, out_path)
+    return len(parents)
+
+
+class TaxonomyIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.max_taxid, rank_len, self._names_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != TAXONOMY_INDEX_MAGIC: self.close(); raise ValueError(f"{path} is not a taxonomy index.")
+        self.ranks = self._mm[_HEADER.size:_HEADER.size + rank_len].decode("utf-8").split("\n")
+        self._table_offset = _HEADER.size + rank_len
+
+    @classmethod
+    def open_optional(cls, path: Optional[str]) -> Optional["TaxonomyIndex"]:
+        """Opens the index if the file exists; returns None otherwise."""
+        if not path or not os.path.exists(path): return None
+        return cls(path)
+
+    def _record(self, taxid: int):
+        if not 0 < taxid <= self.max_taxid: return None
+        rec = _RECORD.unpack_from(self._mm, self._table_offset + taxid * _RECORD.size)
+        return rec if rec[0] else None  # parent 0 marks an unused slot
+
+    def __contains__(self, taxid: int) -> bool: return self._record(taxid) is not None
+
+    def parent(self, taxid: int) -> Optional[int]:
+        rec = self._record(taxid); return rec[0] if rec else None
+
+    def rank(self, taxid: int) -> Optional[str]:
+        rec = self._record(taxid); return self.ranks[rec[3]] if rec else None
+
+    def name(self, taxid: int) -> Optional[str]:
+        rec = self._record(taxid)
+        if not rec: return None
+        start = self._names_offset + rec[1]
+        return self._mm[start:start + rec[2]].decode("utf-8", "replace")
+
+    def lineage(self, taxid: int) -> List[int]:
+        """Returns taxid and its ancestors, nearest first, ending at the root."""
+        lineage = []
+        while taxid in self and len(lineage) < MAX_LINEAGE_DEPTH:
+            lineage.append(taxid)
+            parent = self.parent(taxid)
+            if parent == taxid or taxid == ROOT_TAXID: break
+            taxid = parent
+        return lineage
+
+    def ancestor_at_rank(self, taxid: int, rank: str) -> Optional[int]:
+        for node in self.lineage(taxid):
+            if self.rank(node) == rank: return node
+        return None
+
+    def in_clade(self, taxid: int, clades: Set[str]) -> bool:
+        """True if any lineage node matches one of clades, given as taxids or lowercase names."""
+        for node in self.lineage(taxid):
+            if str(node) in clades or (self.name(node) or "").lower() in clades: return True
+        return False
+
+    def close(self):
+        if getattr(self, "_mm", None) is not None: self._mm.close(); self._mm = None
+        self._file.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "build":
+        count = build_taxonomy_index(sys.argv[2], sys.argv[3], sys.argv[4])
+        print(f"Indexed {count} taxa into {sys.argv[4]} ({os.path.getsize(sys.argv[4])} bytes).")
+    elif len(sys.argv) >= 4 and sys.argv[1] == "lookup":
+        tax = TaxonomyIndex(sys.argv[2])
+        for arg in sys.argv[3:]:
+            print(" < ".join(f"{tax.name(t)} ({tax.rank(t)}, {t})" for t in tax.lineage(int(arg))) or f"{arg}: not found")
+    else:
+        print("Usage: python taxonomy.py build nodes.dmp names.dmp OUT | lookup INDEX TAXID...")
+        sys.exit(1)